@@ -0,0 +1,182 @@
+"""
+保存形式ごとのファイルサイズとメモリ使用量（RSS）の比較ベンチマーク
+
+  legacy : Base64画像を含む単一JSON（従来形式）
+  split  : インデックスJSON + コンテンツアドレス方式の画像ディレクトリ
+  payload: ペイロードのみのインデックスJSON（シンボルは表示時に再生成）
+
+メモリ上の表現ごとに、ロード後に保持されるメモリ（tracemalloc）も比較する
+  dict  : JSONの辞書のまま保持（従来）
+  record: CodeRecord（__slots__、画像のハッシュは生のバイト列）に変換して保持
+
+使い方:
+  python benchmarks/bench_storage_format.py [--counts 1000 10000] [--json]
+"""
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FORMATS = ("legacy", "split", "payload")
+# メモリ上の表現（legacyはBase64画像を含むため、移行前の辞書のみ）
+REPRESENTATIONS = ("dict", "record")
+
+
+def current_rss():
+    """現在のプロセスの常駐メモリ（バイト）を返す"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # 取得できない環境ではピーク値で代用
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def directory_size(path):
+    """ディレクトリ以下のファイルサイズの合計を返す"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def write_formats(workdir, count):
+    """count個のコードを3つの形式で書き出し、形式ごとのパスとファイルサイズを返す"""
+    from datamatrix_core import ImageStore, generate_datamatrix, image_to_png
+
+    payloads = [f"BENCH-{i:08d}" for i in range(count)]
+    pngs = [image_to_png(generate_datamatrix(data)) for data in payloads]
+
+    legacy_path = os.path.join(workdir, "legacy.json")
+    with open(legacy_path, "w") as f:
+        json.dump({
+            "codes": [{"data": data, "image": base64.b64encode(png).decode()}
+                      for data, png in zip(payloads, pngs)],
+            "current_index": 0,
+        }, f)
+
+    image_dir = os.path.join(workdir, "images")
+    store = ImageStore(image_dir)
+    split_path = os.path.join(workdir, "split.index.json")
+    with open(split_path, "w") as f:
+        json.dump({
+            "version": 2,
+            "settings": {"store_images": True},
+            "codes": [{"data": data, "image_hash": store.put(png)}
+                      for data, png in zip(payloads, pngs)],
+            "current_index": 0,
+        }, f)
+
+    payload_path = os.path.join(workdir, "payload.index.json")
+    with open(payload_path, "w") as f:
+        json.dump({
+            "version": 2,
+            "settings": {"store_images": False},
+            "codes": [{"data": data} for data in payloads],
+            "current_index": 0,
+        }, f)
+
+    return {
+        "legacy": (legacy_path, os.path.getsize(legacy_path)),
+        "split": (split_path, os.path.getsize(split_path) + directory_size(image_dir)),
+        "payload": (payload_path, os.path.getsize(payload_path)),
+    }
+
+
+def measure_load(path, representation):
+    """別プロセスでファイルをロードし、ロード時間、増加したRSS、保持されるメモリを測定する"""
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                      "--load", path, "--representation", representation])
+    return json.loads(output)
+
+
+def load_codes(path, representation):
+    """アプリと同じようにコード一覧をロードし、指定した表現で返す"""
+    from datamatrix_core import CodeRecord
+
+    with open(path, "r") as f:
+        codes = json.load(f).get("codes", [])
+    if representation == "record":
+        codes = [CodeRecord.from_dict(entry) for entry in codes]
+    return codes
+
+
+def load_worker(path, representation):
+    """コード一覧をメモリに保持した状態のRSS増加量と、保持されるメモリ量を出力する"""
+    import gc
+    import importlib
+    import tracemalloc
+
+    # モジュールの読み込み分をRSSの増加に含めない
+    importlib.import_module("datamatrix_core")
+    before = current_rss()
+    start = time.perf_counter()
+    codes = load_codes(path, representation)
+    elapsed = time.perf_counter() - start
+    after = current_rss()
+    count = len(codes)
+    del codes
+    gc.collect()
+
+    # 変換途中の一時オブジェクトを除き、一覧として残る分だけを数える
+    tracemalloc.start()
+    codes = load_codes(path, representation)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del codes
+    print(json.dumps({"codes": count, "load_seconds": elapsed,
+                      "rss_bytes": after - before, "retained_bytes": retained}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000],
+                        help="比較するコード数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--load", help=argparse.SUPPRESS)
+    parser.add_argument("--representation", choices=REPRESENTATIONS, default="dict",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        load_worker(args.load, args.representation)
+        return
+
+    results = []
+    for count in args.counts:
+        with tempfile.TemporaryDirectory() as workdir:
+            for fmt, (path, file_bytes) in write_formats(workdir, count).items():
+                for representation in REPRESENTATIONS if fmt != "legacy" else ("dict",):
+                    result = {"format": fmt, "representation": representation,
+                              "count": count, "file_bytes": file_bytes}
+                    result.update(measure_load(path, representation))
+                    results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'format':<8} {'repr':<7} {'codes':>7} {'file KiB':>10} {'RSS KiB':>10} "
+          f"{'kept KiB':>10} {'load ms':>9}")
+    for r in results:
+        print(f"{r['format']:<8} {r['representation']:<7} {r['count']:>7} "
+              f"{r['file_bytes'] / 1024:>10.1f} {r['rss_bytes'] / 1024:>10.1f} "
+              f"{r['retained_bytes'] / 1024:>10.1f} {r['load_seconds'] * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+エンコーダーのバックエンドの照合
+numpyバックエンドが生成したシンボルのモジュールを、pylibdmtx（libdmtx）が生成したものと比較し、
+一致しない件数とバックエンドごとのスループットを出力する
+
+pylibdmtxが利用できない環境では、numpyバックエンドの自己検査（規格の符号化例）と、
+画像から復元したモジュールが符号化結果と一致するかだけを確認する（照合はskippedと記録する）
+
+使い方:
+  python benchmarks/check_encoders.py [--count 500] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def sample_payloads(count):
+    """照合用のペイロード（数字のみ、英数字、記号、128以上のバイトを含むもの、サイズの境界付近）"""
+    rng = random.Random(0)
+    alphabets = ("0123456789", "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-",
+                 "abcdefghijklmnopqrstuvwxyz !\"#$%&'()*+,-./:;<=>?@[]_{}")
+    payloads = [b"", b"1", b"123456", "テスト".encode("utf8"), bytes(range(256))[:200]]
+    while len(payloads) < count:
+        alphabet = rng.choice(alphabets)
+        length = rng.choice((rng.randrange(1, 40), rng.randrange(1, 400)))
+        payloads.append("".join(rng.choice(alphabet) for _ in range(length)).encode("utf8"))
+    return payloads[:count]
+
+
+def throughput(backend, payloads):
+    """payloadsを1回ずつ符号化したときの1秒あたりの件数"""
+    start = time.perf_counter()
+    for data in payloads:
+        backend.encode(data)
+    elapsed = time.perf_counter() - start
+    return len(payloads) / elapsed if elapsed > 0 else None
+
+
+def check(count):
+    """照合を行い、結果の辞書を返す"""
+    from datamatrix_encoders import BACKENDS, encode_modules, self_check
+    from datamatrix_export import image_to_modules
+
+    numpy_backend = BACKENDS["numpy"]
+    reference = BACKENDS["pylibdmtx"]
+    payloads = sample_payloads(count)
+    report = {"payloads": len(payloads), "self_check": self_check(), "mismatches": [],
+              "throughput": {}}
+
+    for data in payloads:
+        modules = encode_modules(data).tolist()
+        if image_to_modules(numpy_backend.encode(data)) != modules:
+            report["mismatches"].append({"payload": data.hex(), "against": "render"})
+        if reference.available() and image_to_modules(reference.encode(data)) != modules:
+            report["mismatches"].append({"payload": data.hex(), "against": reference.name})
+
+    report["reference"] = reference.name if reference.available() else "skipped"
+    for backend in BACKENDS.values():
+        if backend.available():
+            report["throughput"][backend.name] = throughput(backend, payloads)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="エンコーダーのバックエンドの照合")
+    parser.add_argument("--count", type=int, default=500, help="照合するペイロードの数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    report = check(args.count)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(f"自己検査: {'OK' if report['self_check'] else 'NG'}")
+        print(f"照合: {report['reference']}（{report['payloads']}件、"
+              f"不一致{len(report['mismatches'])}件）")
+        for mismatch in report["mismatches"][:10]:
+            print(f"  {mismatch['against']}: {mismatch['payload'][:60]}")
+        for name, rate in report["throughput"].items():
+            print(f"{name:>10}: {rate:,.0f} 件/秒")
+
+    return 0 if report["self_check"] and not report["mismatches"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,457 @@
+"""
+性能ベンチマークスイート
+  encode    : generate_datamatrixとエンコーダーのバックエンドごとのペイロードサイズ別スループット
+              （QRコードとの比較を含む）
+  storage   : CodeStoreのload/saveのコード数別レイテンシ（10〜10000件）と、
+              別のインスタンスの追加をジャーナルから取り込むまでのレイテンシ
+  navigation: update_display / update_buttonsの1ステップあたりのコスト
+  search    : 検索インデックスの作成・更新と、モード別の検索レイテンシ（50000件、ゼロ埋めの連番に
+              一致しない長い検索語を入力した場合を含む）
+  sheet     : 印刷用シートの1ページの合成と、複数ページのPDFの書き出しのプロセス数別スループット
+
+結果はJSONで出力し、--compareで以前の結果と比較できる
+
+使い方:
+  python benchmarks/run_benchmarks.py [--only encode storage navigation search sheet] [-o results.json]
+  python benchmarks/run_benchmarks.py --compare previous.json [--threshold 0.1]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUITES = ("encode", "storage", "navigation", "search", "sheet")
+
+# 検索を対話的とみなすレイテンシの上限（秒、p95）
+SEARCH_BUDGET_SECONDS = 0.1
+
+
+def measure(func, min_time=0.2, min_runs=5):
+    """funcを繰り返し実行し、1回あたりの所要時間（秒）のリストを返す"""
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_runs or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(name, params, samples):
+    """計測結果を1件分の辞書にまとめる"""
+    ordered = sorted(samples)
+    median = statistics.median(ordered)
+    return {
+        "name": name,
+        "params": params,
+        "runs": len(ordered),
+        "median_seconds": median,
+        "p95_seconds": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "ops_per_second": 1 / median if median > 0 else None,
+    }
+
+
+def payload_of_size(size):
+    """指定した長さのペイロード（英数字）を作成"""
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    return "".join(alphabet[i % len(alphabet)] for i in range(size))
+
+
+def bench_encode(quick=False):
+    """
+    ペイロードサイズごとの符号化スループット
+    利用できるエンコーダーのバックエンドごとに計測し、generate_datamatrix（自動選択）も計測する
+    qrcodeがあれば同じペイロードでQRコード（generate_qr）も計測し、symbologyで区別する
+    """
+    from datamatrix_core import encoder_name, generate_datamatrix, generate_qr, qr_available
+    from datamatrix_encoders import BACKENDS
+
+    backends = [backend for backend in BACKENDS.values() if backend.available()]
+    results = []
+    for size in (8, 32, 128) if quick else (8, 32, 128, 512, 1024):
+        data = payload_of_size(size)
+        for backend in backends:
+            payload = data.encode("utf8")
+            samples = measure(lambda: backend.encode(payload))
+            results.append(summarize("encode", {"payload_bytes": size, "backend": backend.name},
+                                     samples))
+        samples = measure(lambda: generate_datamatrix(data))
+        results.append(summarize("encode", {"payload_bytes": size}, samples))
+        results[-1]["selected_backend"] = encoder_name()
+        if qr_available():
+            samples = measure(lambda: generate_qr(data))
+            results.append(summarize("encode", {"payload_bytes": size, "symbology": "qr"}, samples))
+    return results
+
+
+def make_store(workdir, count):
+    """count件のコードを持つCodeStoreを作成（画像の読み込みは発生しないのでハッシュは仮の値）"""
+    from datamatrix_core import CodeRecord, CodeStore
+
+    store = CodeStore(os.path.join(workdir, f"bench_{count}.json"))
+    store.codes = [CodeRecord(f"BENCH-{i:08d}", digest=i.to_bytes(32, "big")) for i in range(count)]
+    return store
+
+
+def bench_storage(quick=False):
+    """コード数ごとのインデックスのload/saveと、ジャーナルの取り込みのレイテンシ"""
+    from datamatrix_core import CodeRecord, CodeStore
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in (10, 100, 1000) if quick else (10, 100, 1000, 10000):
+            store = make_store(workdir, count)
+            samples = measure(store.save)
+            results.append(summarize("save_codes", {"codes": count}, samples))
+
+            def load():
+                CodeStore(store.config_path).load()
+            samples = measure(load)
+            results.append(summarize("load_codes", {"codes": count}, samples))
+
+            # 2つのインスタンスで、一方の追加（ジャーナルへの追記）を他方が取り込むまで
+            writer, reader = CodeStore(store.config_path), CodeStore(store.config_path)
+            writer.load()
+            reader.load()
+
+            def append_and_sync():
+                writer.write_record(writer.append_codes([CodeRecord(f"SYNC-{writer.seq:08d}")]))
+                reader.sync()
+            samples = measure(append_and_sync)
+            results.append(summarize("journal_sync", {"codes": count}, samples))
+    return results
+
+
+class _StubWidget:
+    """ディスプレイがない環境でnavigationを計測するためのウィジェットの代わり"""
+
+    def __init__(self, *args, **options):
+        self.options = dict(options)
+
+    def config(self, **options):
+        self.options.update(options)
+
+    configure = config
+
+    def grid(self, **options):
+        pass
+
+    def grid_remove(self):
+        pass
+
+    def set(self, *args):
+        pass
+
+    def bind(self, *args):
+        pass
+
+
+class _StubRoot:
+    """アイドル時の処理を溜めておき、計測区間の外で実行するルートウィンドウの代わり"""
+
+    def __init__(self):
+        self.idle = []
+
+    def after(self, ms, func=None, *args):
+        return None
+
+    def after_idle(self, func, *args):
+        self.idle.append((func, args))
+        return len(self.idle)
+
+    def after_cancel(self, job):
+        pass
+
+    def run_idle(self):
+        while self.idle:
+            func, args = self.idle.pop(0)
+            func(*args)
+
+
+def build_tool(store, root):
+    """
+    計測用のDataMatrixToolを作成
+    rootがTkならウィジェットを実際に作成し、そうでなければスタブを使う
+    """
+    import main
+
+    tool = main.DataMatrixTool.__new__(main.DataMatrixTool)
+    tool.root = root
+    tool.store = store
+    tool.photo_cache = main.PhotoImageCache(max_size=main.DataMatrixTool.PHOTO_CACHE_SIZE)
+    tool._prefetch_job = None
+    tool.presets_pending = False
+    tool.search_index = None
+    tool.search_query = ""
+    tool.filtered_codes = None
+    tool.filter_position = None
+    # 既定のウィンドウ（350x250）の表示エリアに合わせて拡大する
+    tool.zoom = 0
+    tool.display_size = (230, 190)
+    tool.symbol_sizes = {}
+    tool._rescale_job = None
+
+    if isinstance(root, _StubRoot):
+        tool.code_display = _StubWidget()
+        tool.buttons_frame = _StubWidget()
+        tool.buttons_scrollbar = _StubWidget()
+        tool.code_buttons = []
+        tool.button_states = []
+        tool.button_offset = 0
+        # PhotoImageはTkが必要なので、PNGのデコードと拡大までを計測する
+        tool.create_photo = tool.scaled_image
+        tool.create_code_button = lambda cell: _StubWidget()
+    else:
+        tool.always_on_top = main.BooleanVar(value=True)
+        tool.create_ui()
+    return tool
+
+
+def open_root():
+    """非表示のTkルートを作成（ディスプレイがなければスタブ）"""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        return root, "tk"
+    except Exception:
+        return _StubRoot(), "stub"
+
+
+def run_idle(root):
+    """先読みなどアイドル時の処理を実行"""
+    if isinstance(root, _StubRoot):
+        root.run_idle()
+    else:
+        root.update()
+
+
+def bench_navigation(quick=False):
+    """1ステップ（next_code）あたりのupdate_displayとupdate_buttonsのコスト"""
+    from datamatrix_core import CodeStore
+
+    count = 100 if quick else 300
+    results = []
+    root, mode = open_root()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            store = CodeStore(os.path.join(workdir, "navigation.json"))
+            store.codes = [store.build_code(f"NAV-{i:06d}") for i in range(count)]
+            tool = build_tool(store, root)
+            tool.update_display()
+            run_idle(root)
+
+            def steps(func, n):
+                samples = []
+                for _ in range(n):
+                    start = time.perf_counter()
+                    func()
+                    samples.append(time.perf_counter() - start)
+                    run_idle(root)
+                return samples
+
+            # 1周目: 前後の先読みを挟みながら初めて表示する
+            samples = steps(tool.next_code, count)
+            results.append(summarize("update_display", {"codes": count, "phase": "first_pass",
+                                                        "root": mode}, samples))
+
+            # 直前に表示した範囲を戻る（キャッシュヒットのみ）
+            samples = steps(tool.prev_code, min(count, tool.PHOTO_CACHE_SIZE // 2))
+            results.append(summarize("update_display", {"codes": count, "phase": "revisit",
+                                                        "root": mode}, samples))
+
+            samples = measure(tool.update_buttons)
+            results.append(summarize("update_buttons", {"codes": count, "root": mode}, samples))
+            results[-1]["photo_cache"] = tool.photo_cache.stats()
+    finally:
+        if not isinstance(root, _StubRoot):
+            root.destroy()
+    return results
+
+
+def search_codes(count):
+    """検索用のコード一覧（品番風のdataと、重複の多いname）"""
+    import random
+    from datamatrix_core import CodeRecord
+
+    rng = random.Random(0)
+    kinds = ("LOT", "PART", "SERIAL", "ASSY", "BOX", "PALLET")
+    return [CodeRecord(f"{rng.choice(kinds)}-{i:06d}-{rng.randrange(16 ** 6):06X}",
+                       f"品目{i % 977} {rng.choice(kinds).lower()}",
+                       i.to_bytes(32, "big"))
+            for i in range(count)]
+
+
+def bench_search(quick=False):
+    """
+    検索インデックスの作成、追加・削除、モード別の検索のレイテンシ
+    検索はp95がSEARCH_BUDGET_SECONDS以内かをwithin_budgetに記録する
+    """
+    from datamatrix_core import CodeRecord
+    from datamatrix_search import CodeIndex
+
+    count = 5000 if quick else 50000
+    codes = search_codes(count)
+    results = []
+
+    samples = measure(lambda: CodeIndex(codes), min_time=0, min_runs=3)
+    results.append(summarize("search_index_build", {"codes": count}, samples))
+
+    index = CodeIndex(codes)
+    extra = CodeRecord("NEW-000000-ABCDEF", "追加")
+
+    def add_remove():
+        index.add(extra)
+        index.remove(extra)
+    samples = measure(add_remove)
+    results.append(summarize("search_index_add_remove", {"codes": count}, samples))
+
+    queries = (
+        ("prefix", "lot-01"),
+        ("prefix", "品目12"),
+        ("substring", "0042"),
+        ("substring", "7"),
+        ("fuzzy", "l1a9"),
+        ("auto", "box"),
+        ("auto", "pt12"),
+    )
+    for mode, query in queries:
+        samples = measure(lambda: index.search(query, mode))
+        result = summarize("search", {"codes": count, "mode": mode, "query": query}, samples)
+        result["matches"] = len(index.search(query, mode))
+        result["within_budget"] = result["p95_seconds"] <= SEARCH_BUDGET_SECONDS
+        results.append(result)
+
+    # ゼロ埋めの連番のような繰り返しの多いdataに、一致しない長い検索語を入力したとき
+    # （あいまい一致がバックトラックで遅くならないか）
+    padded = {
+        "serial": [CodeRecord(f"SN{i:016d}") for i in range(count)],
+        "zero_padded": [CodeRecord(f"{i:020d}") for i in range(count)],
+    }
+    padded_queries = (
+        ("serial", "sn0000000000095555"),
+        ("zero_padded", "0" * 21),
+    )
+    for data, query in padded_queries:
+        padded_index = CodeIndex(padded[data])
+        samples = measure(lambda: padded_index.search(query), min_runs=3)
+        result = summarize("search", {"codes": count, "mode": "auto", "query": query, "data": data},
+                           samples)
+        result["matches"] = len(padded_index.search(query))
+        result["within_budget"] = result["p95_seconds"] <= SEARCH_BUDGET_SECONDS
+        results.append(result)
+    return results
+
+
+def bench_sheet(quick=False):
+    """
+    キャプション付きの1ページの合成と、write_sheetsでPDFを書き出すときのスループット
+    書き出しはプロセスプールなし（jobs=1）とCPU数のプロセスで計測し、codes_per_secondを記録する
+    """
+    from datamatrix_core import generate_datamatrix, image_to_png
+    from datamatrix_export import SheetLayout, compose_page, write_sheets
+
+    layout = SheetLayout()
+    pngs = [image_to_png(generate_datamatrix(f"SHEET-{i:06d}")) for i in range(layout.per_page)]
+    captions = [f"SHEET-{i:06d}" for i in range(layout.per_page)]
+    results = []
+
+    samples = measure(lambda: compose_page(pngs, layout, captions))
+    results.append(summarize("sheet_compose_page", {"per_page": layout.per_page}, samples))
+
+    count = 500 if quick else 5000
+    with tempfile.TemporaryDirectory() as workdir:
+        output = os.path.join(workdir, "sheet.pdf")
+        for jobs in sorted({1, os.cpu_count() or 1}):
+            items = ((pngs[i % len(pngs)], captions[i % len(captions)]) for i in range(count))
+            start = time.perf_counter()
+            pages = write_sheets(items, output, layout=layout, jobs=jobs)
+            elapsed = time.perf_counter() - start
+            result = summarize("sheet_write", {"codes": count, "jobs": jobs}, [elapsed])
+            result["pages"] = pages
+            result["codes_per_second"] = count / elapsed if elapsed > 0 else None
+            results.append(result)
+    return results
+
+
+def environment():
+    """結果を比較するときに参照する実行環境の情報"""
+    from importlib.metadata import version
+
+    def package_version(name):
+        try:
+            return version(name)
+        except Exception:
+            return None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pylibdmtx": package_version("pylibdmtx"),
+        "qrcode": package_version("qrcode"),
+    }
+
+
+def result_key(result):
+    """以前の結果と対応付けるためのキー"""
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(previous, current, threshold):
+    """以前の結果と比較し、threshold以上遅くなった項目を返す"""
+    baseline = {result_key(r): r for r in previous["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = baseline.get(result_key(result))
+        if old is None or not old["median_seconds"]:
+            continue
+        ratio = result["median_seconds"] / old["median_seconds"]
+        if ratio > 1 + threshold:
+            regressions.append({"name": result["name"], "params": result["params"],
+                                "previous": old["median_seconds"],
+                                "current": result["median_seconds"], "ratio": ratio})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data Matrixコードツールの性能ベンチマーク")
+    parser.add_argument("--only", nargs="+", choices=SUITES, default=list(SUITES),
+                        help="実行するベンチマーク")
+    parser.add_argument("--quick", action="store_true", help="件数を減らして短時間で実行")
+    parser.add_argument("-o", "--output", help="結果のJSONを書き出すファイル（省略時は標準出力）")
+    parser.add_argument("--compare", metavar="PREVIOUS", help="比較する以前の結果のJSON")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="遅くなったと判定する割合（0.1で10%%）")
+    args = parser.parse_args()
+
+    benches = {"encode": bench_encode, "storage": bench_storage, "navigation": bench_navigation,
+               "search": bench_search, "sheet": bench_sheet}
+    report = {"environment": environment(), "results": []}
+    # アプリのデバッグ出力でJSONが壊れないよう、計測中の標準出力は標準エラーに回す
+    with contextlib.redirect_stdout(sys.stderr):
+        for suite in args.only:
+            report["results"].extend(benches[suite](quick=args.quick))
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            report["regressions"] = compare(json.load(f), report, args.threshold)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1113 @@
+"""
+Data Matrixコード（とQRコード）の生成と保存のコア
+tkinterやPIL.ImageTkに依存しないので、ディスプレイのない環境（CI、印刷準備サーバーなど）でも使える
+"""
+import base64
+import csv
+import getpass
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import islice
+
+from datamatrix_encoders import backend_for, get_backend
+from datamatrix_instrumentation import span
+
+try:
+    import fcntl
+except ImportError:
+    # Windowsではmsvcrtでロックする
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+def datamatrix_available():
+    """Data Matrixコードを生成できるか（初回はエンコーダーの読み込みと選択を伴う）"""
+    return get_backend() is not None
+
+
+def encoder_name():
+    """使用するエンコーダーのバックエンド名（利用できなければNone）"""
+    backend = get_backend()
+    return backend.name if backend is not None else None
+
+
+def generate_datamatrix(data, **options):
+    """
+    Data Matrixコードを生成
+    optionsはエンコーダーにそのまま渡す（scheme, sizeなど。pylibdmtx.encodeと同じ名前）
+    エンコーダーは起動後最初の呼び出しで選択する（datamatrix_encodersを参照）
+    """
+    backend = backend_for(options)
+    if backend is None:
+        raise ImportError("Data Matrixエンコーダーがありません（pylibdmtxまたはnumpyが必要です）")
+
+    with span("encode"):
+        return backend.encode(data.encode('utf8'), **options)
+
+
+# qrcodeは任意の依存なので、QRコードを初めて生成するときに読み込む
+_qrcode = None
+_qrcode_checked = False
+
+# QRコードの描画（モジュールはData Matrixと同じ5ピクセル、余白は規格のクワイエットゾーンの4モジュール）
+QR_MODULE_SIZE = 5
+QR_QUIET_ZONE = 4
+# 誤り訂正レベル（L / M / Q / H）
+QR_ERROR_CORRECTION = "M"
+
+
+def load_qrcode():
+    """qrcodeを初回使用時にインポートして返す（利用できなければNone）"""
+    global _qrcode, _qrcode_checked
+    if not _qrcode_checked:
+        with span("import_encoder"):
+            try:
+                import qrcode
+                _qrcode = qrcode
+            except ImportError as e:
+                logger.debug("qrcodeを読み込めません: %s", e)
+        _qrcode_checked = True
+    return _qrcode
+
+
+def qr_available():
+    """QRコードを生成できるか"""
+    return load_qrcode() is not None
+
+
+def qr_modules(data, error_correction=QR_ERROR_CORRECTION):
+    """ペイロードをQRコードに符号化し、モジュールの行列（行ごとのboolのリスト、余白なし）を返す"""
+    qrcode = load_qrcode()
+    if qrcode is None:
+        raise ImportError("qrcodeがインストールされていません（pip install qrcode）")
+    if error_correction not in ("L", "M", "Q", "H"):
+        raise ValueError(f"誤り訂正レベルが不正です: {error_correction}")
+
+    qr = qrcode.QRCode(error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{error_correction}"),
+                       border=0)
+    qr.add_data(data.encode('utf8'))
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def generate_qr(data, **options):
+    """
+    QRコードを生成
+    optionsはqr_modulesに渡す（error_correction）。戻り値はgenerate_datamatrixと同じくRGBのPIL画像
+    """
+    from PIL import Image, ImageOps
+
+    with span("encode"):
+        modules = qr_modules(data, **options)
+        size = len(modules)
+        img = Image.frombytes("L", (size, size),
+                              bytes(0 if dark else 255 for row in modules for dark in row))
+        img = img.resize((size * QR_MODULE_SIZE, size * QR_MODULE_SIZE), Image.NEAREST)
+        return ImageOps.expand(img, QR_QUIET_ZONE * QR_MODULE_SIZE, fill=255).convert("RGB")
+
+
+# シンボル体系と表示名（既定はData Matrix。保存形式では既定の場合は省略する）
+SYMBOLOGIES = {"datamatrix": "Data Matrix", "qr": "QR"}
+DEFAULT_SYMBOLOGY = "datamatrix"
+
+
+def symbology_available(symbology):
+    """シンボル体系のコードを生成できるか"""
+    if symbology == "qr":
+        return qr_available()
+    return symbology == DEFAULT_SYMBOLOGY and datamatrix_available()
+
+
+def generate_symbol(data, symbology=DEFAULT_SYMBOLOGY, **options):
+    """シンボル体系に応じてコードを生成（optionsはそれぞれの生成関数に渡す）"""
+    if symbology == "qr":
+        return generate_qr(data, **options)
+    if symbology != DEFAULT_SYMBOLOGY:
+        raise ValueError(f"未対応のシンボル体系です: {symbology}")
+    return generate_datamatrix(data, **options)
+
+
+def image_to_png(img):
+    """画像をPNGのバイト列に変換"""
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def detect_import_format(path):
+    """ファイルの拡張子から一括インポートの形式を判定"""
+    ext = os.path.splitext(path)[1].lower()
+    return {".csv": "csv", ".tsv": "tsv", ".tab": "tsv"}.get(ext, "lines")
+
+
+def iter_payloads(stream, fmt="lines"):
+    """
+    一括インポート用の入力を1件ずつ読み込み、(data, name) を返すジェネレータ
+    fmt: "csv" / "tsv" / "lines"（1行に1データ）
+    CSV/TSVはヘッダーにdata列（とname列）があればそれを使い、
+    なければ1列目をdata、2列目をnameとして扱う
+    """
+    if fmt == "lines":
+        for line in stream:
+            if line.strip():
+                yield line.strip(), None
+        return
+
+    delimiter = "," if fmt == "csv" else "\t"
+    data_col, name_col = 0, 1
+    first = True
+    for row in csv.reader(stream, delimiter=delimiter):
+        if not any(cell.strip() for cell in row):
+            continue
+
+        if first:
+            first = False
+            header = [cell.strip().lower() for cell in row]
+            if "data" in header:
+                data_col = header.index("data")
+                name_col = header.index("name") if "name" in header else None
+                continue
+
+        data = row[data_col].strip() if data_col < len(row) else ""
+        if not data:
+            continue
+        name = None
+        if name_col is not None and name_col < len(row) and row[name_col].strip():
+            name = row[name_col].strip()
+        yield data, name
+
+
+def read_payloads(stream, fmt="lines"):
+    """一括インポート用の入力を全て読み込み、(data, name) のリストを返す"""
+    return list(iter_payloads(stream, fmt))
+
+
+def encode_payload(data, symbology=DEFAULT_SYMBOLOGY):
+    """
+    プロセスプール用: ペイロードを符号化し (data, PNG, エラー) を返す
+    Data Matrix以外はfunctools.partialでsymbologyを指定してworkerに渡す
+    """
+    try:
+        return data, image_to_png(generate_symbol(data, symbology)), None
+    except Exception as e:
+        return data, None, str(e)
+
+
+def bulk_encode(payloads, jobs=None, chunksize=32, worker=encode_payload):
+    """
+    ペイロードをプロセスプールで並列に符号化し、入力順に (data, 結果, エラー) を返す
+    入力はイテレータでもよく、一定数ずつ投入するので全件をメモリに載せない
+    jobs=1の場合はプロセスプールを使わずに同じプロセスで処理する
+    """
+    payloads = iter(payloads)
+    if jobs == 1:
+        for data in payloads:
+            yield worker(data)
+        return
+
+    window = (jobs or os.cpu_count() or 1) * chunksize * 4
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            batch = list(islice(payloads, window))
+            if not batch:
+                break
+            yield from executor.map(worker, batch, chunksize=chunksize)
+
+
+def atomic_write(path, data):
+    """
+    一時ファイルに書き込んでから置き換える
+    書き込み中にクラッシュしても元のファイルが途中で切れた状態にならない
+    """
+    # 一時ファイル名はプロセスとスレッドごとに分け、同時に書き込んでも衝突しないようにする
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class FileLock:
+    """
+    ロックファイルによるプロセス間の排他ロック（Unixはfcntl.flock、Windowsはmsvcrt.locking）
+    with文で使う。同じオブジェクトは同じスレッドから入れ子で使え、別のスレッドは解放を待つ
+    """
+
+    # Windowsでロックを取れなかったときに再試行するまでの間隔（秒）
+    RETRY_SECONDS = 0.05
+
+    def __init__(self, path):
+        """ロックファイルのパスを指定して初期化する（ファイルは最初にロックするときに作成）"""
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, "a+b")
+                with span("lock_wait"):
+                    self._acquire()
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                try:
+                    self._release()
+                finally:
+                    self._file.close()
+                    self._file = None
+        finally:
+            self._thread_lock.release()
+
+    def _acquire(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            return
+        # msvcrt.lockingは先頭の1バイトをロックする（取れるまで再試行）
+        while True:
+            self._file.seek(0)
+            try:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(self.RETRY_SECONDS)
+
+    def _release(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def get_config_path():
+    """ユーザーごとの設定ファイルパスを取得（旧形式の単一JSON）"""
+    # Windowsのログインユーザー名を取得
+    username = getpass.getuser()
+
+    # ユーザーのホームディレクトリを取得
+    home_dir = os.path.expanduser('~')
+    # アプリケーションの設定ディレクトリを作成
+    config_dir = os.path.join(home_dir, '.datamatrix_tool')
+
+    # ディレクトリが存在しない場合は作成
+    if not os.path.exists(config_dir):
+        try:
+            os.makedirs(config_dir)
+        except Exception as e:
+            logger.warning("設定ディレクトリの作成に失敗しました: %s", e)
+            # 失敗した場合はカレントディレクトリを使用
+            return f"datamatrix_codes_{username}.json"
+
+    # ユーザー固有の設定ファイルパス
+    return os.path.join(config_dir, f'datamatrix_codes_{username}.json')
+
+
+class ImageStore:
+    """
+    コンテンツアドレス方式の画像ストア
+    PNGのバイト列をSHA-256のハッシュ名で保存し、必要になったときだけ読み込む
+    """
+
+    def __init__(self, directory):
+        """画像を保存するディレクトリを指定して初期化する"""
+        self.directory = directory
+
+    def path_for(self, digest):
+        """ハッシュに対応するファイルパスを返す"""
+        return os.path.join(self.directory, digest[:2], f"{digest}.png")
+
+    def put(self, png_bytes, digest=None):
+        """
+        PNGを保存してハッシュを返す（同じ内容は一度だけ書き込む）
+        digestを指定した場合は内容のハッシュの代わりにその名前で保存する
+        """
+        if digest is None:
+            digest = hashlib.sha256(png_bytes).hexdigest()
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 書き込み途中のファイルが残らないよう一時ファイルから置き換える
+            with span("image_write"):
+                atomic_write(path, png_bytes)
+        return digest
+
+    def get(self, digest):
+        """ハッシュに対応するPNGのバイト列を読み込む"""
+        with span("image_read"), open(self.path_for(digest), "rb") as f:
+            return f.read()
+
+
+class RenderCache:
+    """
+    ペイロードから生成したシンボル画像（PNG）のLRUキャッシュ
+    シンボルは (data, エンコーダオプション, シンボル体系) の純粋関数なので、このキーでメモ化する
+    disk_storeを指定すると生成結果をディスクにも永続化する
+    ワーカースレッドとTkスレッドの両方から使えるようにロックで保護する
+    """
+
+    def __init__(self, max_size=256, disk_store=None):
+        """最大保持数と任意のディスクキャッシュを指定して初期化する"""
+        self.max_size = max_size
+        self.disk_store = disk_store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def key(data, options=None, symbology=DEFAULT_SYMBOLOGY):
+        """
+        キャッシュキー (data, ソート済みオプション[, シンボル体系]) を返す
+        Data Matrixは従来と同じキーにして、ディスクキャッシュをそのまま使えるようにする
+        """
+        key = (data, tuple(sorted((options or {}).items())))
+        if symbology != DEFAULT_SYMBOLOGY:
+            key += (symbology,)
+        return key
+
+    def get(self, data, options=None, symbology=DEFAULT_SYMBOLOGY):
+        """シンボルのPNGを返す（メモリ → ディスク → 生成の順に探す）"""
+        key = self.key(data, options, symbology)
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return png
+            self.misses += 1
+
+        digest = hashlib.sha256(json.dumps(key).encode("utf8")).hexdigest()
+        if self.disk_store is not None:
+            try:
+                png = self.disk_store.get(digest)
+                self.disk_hits += 1
+            except OSError:
+                png = None
+
+        if png is None:
+            png = image_to_png(generate_symbol(data, symbology, **dict(key[1])))
+            if self.disk_store is not None:
+                self.disk_store.put(png, digest=digest)
+
+        with self._lock:
+            self._entries[key] = png
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return png
+
+    def stats(self):
+        """ヒット/ミスの統計を返す"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+        }
+
+
+class CodeRecord:
+    """
+    コード一覧の1件
+    辞書の代わりに__slots__で属性を固定し、画像のハッシュは16進文字列ではなく
+    32バイトの生のバイト列で持つ（PNG本体は画像ストアにあり、表示時に読み込む）
+    作成後は変更しないので、保存時は一覧を複製するだけでよい
+    保存形式（JSON）との変換はfrom_dict / to_dictで行い、ファイルの形式は変わらない
+    """
+
+    __slots__ = ("data", "name", "digest", "options", "symbology", "extra")
+
+    # 保存形式の辞書のうち、属性として持つ項目
+    FIELDS = frozenset(("data", "name", "image_hash", "options", "symbology"))
+
+    def __init__(self, data, name=None, digest=None, options=None, extra=None,
+                 symbology=DEFAULT_SYMBOLOGY):
+        """ペイロード、名前、画像のハッシュ（バイト列）、エンコーダオプション、シンボル体系を指定して作成する"""
+        self.data = data
+        self.name = name
+        self.digest = digest
+        self.options = options
+        # 表示や再生成のたびに判定し直さないよう、シンボル体系はコードごとに保持する
+        self.symbology = symbology
+        # このバージョンが知らない項目（保存時にそのまま書き戻す）
+        self.extra = extra
+
+    @property
+    def image_hash(self):
+        """画像ストアのハッシュ（16進文字列）。ペイロードのみのコードはNone"""
+        return self.digest.hex() if self.digest is not None else None
+
+    @classmethod
+    def from_dict(cls, entry):
+        """インデックスファイルの1件（辞書）から作成する"""
+        extra = None
+        if entry.keys() - cls.FIELDS:
+            extra = {key: value for key, value in entry.items() if key not in cls.FIELDS}
+        image_hash = entry.get("image_hash")
+        return cls(entry["data"], entry.get("name"),
+                   bytes.fromhex(image_hash) if image_hash else None,
+                   entry.get("options"), extra, entry.get("symbology", DEFAULT_SYMBOLOGY))
+
+    def to_dict(self):
+        """インデックスファイルに保存する辞書（従来のコードの辞書と同じ形式）"""
+        entry = dict(self.extra) if self.extra else {}
+        entry["data"] = self.data
+        if self.name is not None:
+            entry["name"] = self.name
+        if self.digest is not None:
+            entry["image_hash"] = self.digest.hex()
+        if self.options:
+            entry["options"] = self.options
+        if self.symbology != DEFAULT_SYMBOLOGY:
+            entry["symbology"] = self.symbology
+        return entry
+
+    def __repr__(self):
+        return (f"CodeRecord(data={self.data!r}, name={self.name!r}, "
+                f"symbology={self.symbology!r}, image_hash={self.image_hash!r})")
+
+
+class CodeStore:
+    """
+    ユーザーごとのコード一覧
+    データ・名前・順序だけを持つインデックスJSONと、コンテンツアドレス方式の画像ストアからなる
+
+    複数のインスタンス（同時に起動したウィンドウ）から同じ一覧を使えるように:
+    - 追加・削除は追記専用のジャーナルに書き込み、他のインスタンスはsyncで追記分だけを取り込む
+    - ファイルの読み書き（write_record、read_changes、write_snapshot）はワーカースレッドで行え、
+      一覧の変更（append_codes、delete_code、apply_changes、snapshot）は一覧を持つスレッドで行う
+    - 保存はジャーナルをインデックスにまとめ直す操作で、取り込んでいない他のインスタンスの追記は
+      新しいジャーナルに残す（後から書いた方が上書きして変更が失われることはない）
+    - ジャーナルの各レコードは (書き込み元, 連番) を持ち、取り込み済みの連番以下は適用しない
+    - ファイルの読み書きはロックファイルで排他する
+
+    設定（インデックスファイルの"settings"）:
+    - store_images: Falseにするとペイロードだけを保存し、シンボルは表示時に再生成する
+    - disk_render_cache: 再生成したシンボルをディスクにもキャッシュする
+    """
+
+    # インデックスファイルの形式バージョン
+    INDEX_VERSION = 2
+    # 再生成したシンボルのキャッシュの最大数
+    RENDER_CACHE_SIZE = 256
+    # 設定のデフォルト値
+    DEFAULT_SETTINGS = {
+        "store_images": True,
+        "disk_render_cache": False,
+    }
+
+    def __init__(self, config_path=None):
+        """旧形式の設定ファイルパス（省略時はユーザーごとのパス）を基準に初期化する"""
+        self.config_path = config_path or get_config_path()
+        self.codes = []
+        self.current_index = 0
+
+        # ジャーナル: インデックスの世代、書き込み元ごとの取り込み済みの連番、読み終えた位置
+        self.lock = FileLock(self.lock_path)
+        self.writer = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.generation = 0
+        self.applied = {}
+        self.journal_offset = 0
+        # 自分の記録のうち、読み込んだジャーナルやインデックスでまだ確認していないもの（読み直しで反映し直す）
+        self.own_records = []
+
+        # 設定（インデックスファイルからロードされる）
+        self.settings = dict(self.DEFAULT_SETTINGS)
+
+        # 画像はインデックスとは別にコンテンツアドレス方式で保存
+        self.image_store = ImageStore(self.image_dir)
+
+        # ペイロードのみのコードはここで再生成したシンボルを使う
+        self.render_cache = RenderCache(max_size=self.RENDER_CACHE_SIZE)
+
+    @property
+    def index_path(self):
+        """インデックスファイル（データ・名前・順序のみ）のパス"""
+        return self.config_path[:-len(".json")] + ".index.json"
+
+    @property
+    def journal_path(self):
+        """追加・削除を追記するジャーナルのパス"""
+        return self.config_path[:-len(".json")] + ".journal"
+
+    @property
+    def lock_path(self):
+        """インデックスとジャーナルの読み書きを排他するロックファイルのパス"""
+        return self.config_path[:-len(".json")] + ".lock"
+
+    @property
+    def image_dir(self):
+        """コンテンツアドレス方式の画像ディレクトリのパス"""
+        return os.path.join(os.path.dirname(self.config_path), "images")
+
+    @property
+    def render_cache_dir(self):
+        """再生成したシンボルのディスクキャッシュのパス"""
+        return os.path.join(os.path.dirname(self.config_path), "render_cache")
+
+    @property
+    def verification_path(self):
+        """画像の検証記録のパス（画像ストアと同じく全てのコードセットで共有）"""
+        return os.path.join(os.path.dirname(self.config_path), "verified.json")
+
+    def load(self):
+        """インデックスファイルとジャーナルからコードをロード（旧形式のJSONは一度だけ移行する）"""
+        with self.lock:
+            if not os.path.exists(self.index_path) and os.path.exists(self.config_path):
+                self.migrate_legacy()
+
+            if os.path.exists(self.index_path) or os.path.exists(self.journal_path):
+                data, self.codes, self.generation, self.applied, self.journal_offset = self._read_state()
+                self.current_index = data.get("current_index", 0)
+                self.settings.update(data.get("settings", {}))
+
+                # インデックスが範囲外の場合は調整
+                if self.codes and not (0 <= self.current_index < len(self.codes)):
+                    self.current_index = 0
+
+        self.apply_settings()
+
+    def _read_state(self):
+        """
+        （ロック中に）インデックスと同じ世代のジャーナルを読み、
+        (インデックスの内容, コード, 世代, 取り込み済みの連番, ジャーナルを読み終えた位置) を返す
+        """
+        data = {}
+        if os.path.exists(self.index_path):
+            with span("index_read"), open(self.index_path, "r") as f:
+                data = json.load(f)
+        codes = [CodeRecord.from_dict(entry) for entry in data.get("codes", [])]
+        generation = data.get("generation", 0)
+        applied = dict(data.get("applied", {}))
+
+        offset = 0
+        if os.path.exists(self.journal_path):
+            with span("journal_read"), open(self.journal_path, "rb") as f:
+                header = self._journal_header(f)
+                if header is not None and header["generation"] == generation:
+                    records, offset = self._journal_records(f)
+                    self._apply(codes, applied, records)
+        return data, codes, generation, applied, offset
+
+    @staticmethod
+    def _journal_header(f):
+        """ジャーナルの先頭行（世代と、その世代のインデックスに取り込み済みの連番）を読む。読めなければNone"""
+        line = f.readline()
+        if not line.endswith(b"\n"):
+            return None
+        try:
+            header = json.loads(line)
+        except ValueError:
+            return None
+        return header if "generation" in header else None
+
+    def _journal_records(self, f):
+        """現在位置から最後の完全な行までのレコードを読み、(レコードのリスト, 読み終えた位置) を返す"""
+        records = []
+        position = f.tell()
+        for line in f:
+            if not line.endswith(b"\n"):
+                # 書き込み途中で止まった行（クラッシュ時）は読まない
+                break
+            position += len(line)
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning("ジャーナルの壊れた行を読み飛ばしました: %s", self.journal_path)
+        return records, position
+
+    @staticmethod
+    def _apply(codes, applied, records):
+        """
+        レコードをcodesに適用し、(追加したコード, 削除したコード) を返す
+        書き込み元ごとに取り込み済みの連番以下のレコードは適用しない（appliedを更新する）
+        """
+        added, removed = [], []
+        for record in records:
+            writer, seq = record["writer"], record["seq"]
+            if seq <= applied.get(writer, 0):
+                continue
+            applied[writer] = seq
+            if record["op"] == "add":
+                new = [CodeRecord.from_dict(entry) for entry in record["codes"]]
+                codes.extend(new)
+                added.extend(new)
+            elif record["op"] == "delete":
+                for entry in record["codes"]:
+                    code = CodeStore._take(codes, entry, record.get("index"))
+                    if code is not None:
+                        removed.append(code)
+        return added, removed
+
+    @staticmethod
+    def _take(codes, entry, index=None):
+        """
+        entryと同じ内容のコードを1つ取り除いて返す（なければNone）
+        同じ内容のコードは区別できないので、どれを取り除いても結果の一覧は同じになる
+        """
+        if index is not None and index < len(codes) and codes[index].to_dict() == entry:
+            return codes.pop(index)
+        for i, code in enumerate(codes):
+            if code.to_dict() == entry:
+                return codes.pop(i)
+        return None
+
+    def append_codes(self, codes):
+        """
+        コードを一覧の末尾に追加し、ジャーナルに追記するレコードを返す（codesが空ならNone）
+        追記はwrite_recordで行う
+        """
+        self.codes.extend(codes)
+        if codes:
+            return self.record_change("add", codes)
+        return None
+
+    def delete_code(self, index):
+        """index番目のコードを削除し、(削除したコード, ジャーナルに追記するレコード) を返す"""
+        code = self.codes.pop(index)
+        return code, self.record_change("delete", [code], index)
+
+    def record_change(self, op, codes, index=None):
+        """追加・削除のジャーナルのレコードを作る（変更はメモリ上の一覧に反映済みであること）"""
+        self.seq += 1
+        self.applied[self.writer] = self.seq
+        record = {"writer": self.writer, "seq": self.seq, "op": op,
+                  "codes": [code.to_dict() for code in codes]}
+        if index is not None:
+            record["index"] = index
+        self.own_records.append(record)
+        return record
+
+    def write_record(self, record):
+        """
+        レコードをジャーナルに追記する（レコードを作った順に呼ぶこと。失敗時は例外を送出）
+        ジャーナルがないか、ロードしたインデックスより古い世代のもの（保存中のクラッシュ）なら作り直す
+        """
+        line = json.dumps(record, ensure_ascii=False).encode("utf8") + b"\n"
+        with span("journal_append"), self.lock:
+            header = None
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "rb") as f:
+                    header = self._journal_header(f)
+            if header is None or header["generation"] < self.generation:
+                self._start_journal()
+            with open(self.journal_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _start_journal(self):
+        """（ロック中に）ディスク上のインデックスの世代で空のジャーナルを作る"""
+        data = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        self._write_journal(data.get("generation", 0), data.get("applied", {}), [])
+
+    def _write_journal(self, generation, applied, records):
+        """（ロック中に）ヘッダーとrecordsだけのジャーナルをアトミックに書き込む"""
+        lines = [json.dumps({"generation": generation, "applied": applied})]
+        lines.extend(json.dumps(record, ensure_ascii=False) for record in records)
+        atomic_write(self.journal_path, ("\n".join(lines) + "\n").encode("utf8"))
+
+    def sync(self):
+        """他のインスタンスの変更を読んで一覧に取り込み、(追加されたコード, 削除されたコード, 読み直したか) を返す"""
+        return self.apply_changes(self.read_changes())
+
+    def read_changes(self):
+        """
+        他のインスタンスがジャーナルに追記した変更を読み、apply_changesに渡す内容を返す（一覧は変更しない）
+        他のインスタンスの保存で、まだ取り込んでいない変更がインデックスにまとめられていた場合は
+        インデックスとジャーナルを読み直した一覧を返す
+        """
+        base = (self.generation, self.journal_offset)
+        changes = {"base": base, "generation": base[0], "offset": base[1], "records": [], "confirmed": 0}
+        if not os.path.exists(self.journal_path):
+            return changes
+
+        with span("journal_sync"), self.lock:
+            with open(self.journal_path, "rb") as f:
+                header = self._journal_header(f)
+                if header is None or header["generation"] < base[0]:
+                    return changes
+                offset = base[1]
+                if header["generation"] > base[0]:
+                    if any(seq > self.applied.get(writer, 0) for writer, seq in header["applied"].items()):
+                        _, codes, generation, applied, offset = self._read_state()
+                        changes.update(reload=codes, generation=generation, applied=applied, offset=offset)
+                        return changes
+                    # まとめられた変更は全て取り込み済みなので、新しいジャーナルを先頭から読む
+                    changes["generation"] = header["generation"]
+                    changes["confirmed"] = header["applied"].get(self.writer, 0)
+                    offset = f.tell()
+                f.seek(max(offset, f.tell()))
+                changes["records"], changes["offset"] = self._journal_records(f)
+        return changes
+
+    def apply_changes(self, changes):
+        """
+        read_changesで読んだ変更を一覧に反映し、(追加されたコード, 削除されたコード, 読み直したか) を返す
+        読んだ後に別のsyncで取り込みが進んでいれば、古い内容なので何もしない
+        """
+        if changes["base"] != (self.generation, self.journal_offset):
+            return [], [], False
+        self.generation, self.journal_offset = changes["generation"], changes["offset"]
+        if "reload" in changes:
+            return self._reload(changes["reload"], changes["applied"])
+
+        confirmed = max([changes["confirmed"]] + [record["seq"] for record in changes["records"]
+                                                  if record["writer"] == self.writer])
+        self.own_records = [record for record in self.own_records if record["seq"] > confirmed]
+        added, removed = self._apply(self.codes, self.applied, changes["records"])
+        return added, removed, False
+
+    def _reload(self, codes, applied):
+        """インデックスとジャーナルから読み直した一覧に置き換え、(追加, 削除, True) を返す"""
+        # 読んだ時点でまだジャーナルに書き込まれていなかった自分の変更を反映し直す
+        self.own_records = [record for record in self.own_records
+                            if record["seq"] > applied.get(self.writer, 0)]
+        self._apply(codes, applied, self.own_records)
+        applied[self.writer] = max(self.seq, applied.get(self.writer, 0))
+        self.applied = applied
+
+        # 内容が同じコードは今のオブジェクトを使い、表示用の画像キャッシュなどをそのまま使えるようにする
+        current = {}
+        for code in self.codes:
+            current.setdefault(json.dumps(code.to_dict(), sort_keys=True), []).append(code)
+        merged = []
+        for code in codes:
+            same = current.get(json.dumps(code.to_dict(), sort_keys=True))
+            merged.append(same.pop() if same else code)
+
+        kept = {id(code) for code in merged}
+        previous = {id(code) for code in self.codes}
+        removed = [code for code in self.codes if id(code) not in kept]
+        added = [code for code in merged if id(code) not in previous]
+        self.codes = merged
+        logger.info("他のインスタンスで保存された一覧を読み直しました: %s", self.index_path)
+        return added, removed, True
+
+    def apply_settings(self):
+        """ロードした設定を描画キャッシュなどに反映"""
+        if self.settings["disk_render_cache"]:
+            self.render_cache.disk_store = ImageStore(self.render_cache_dir)
+        else:
+            self.render_cache.disk_store = None
+
+    def snapshot(self):
+        """
+        保存する内容の複製を返す（別スレッドで書き込んでも一覧の変更に影響されない）
+        CodeRecordは変更されないので一覧だけを複製し、辞書への変換は書き込み時に行う
+        """
+        return {
+            "version": self.INDEX_VERSION,
+            "settings": dict(self.settings),
+            "codes": list(self.codes),
+            "current_index": self.current_index,
+            "generation": self.generation,
+            "applied": dict(self.applied),
+        }
+
+    def write_snapshot(self, snapshot):
+        """
+        snapshotの内容をインデックスファイルにアトミックに書き込み、ジャーナルを次の世代で始め直す
+        snapshotに含まれない追記（他のインスタンスの未取り込みの変更や、複製した後の自分の変更）は
+        新しいジャーナルに残す。既に他のインスタンスが新しい世代を書いていれば、変更は全てジャーナルに
+        残っているので何もしない。書き込んだかを返す（失敗時は例外を送出）
+        """
+        with span("index_write"), self.lock:
+            header, records = None, []
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "rb") as f:
+                    header = self._journal_header(f)
+                    if header is not None and header["generation"] == snapshot["generation"]:
+                        records, _ = self._journal_records(f)
+            if header is not None and header["generation"] > snapshot["generation"]:
+                logger.debug("他のインスタンスが先に保存したため書き込みません: %s", self.index_path)
+                return False
+
+            applied = snapshot["applied"]
+            pending = [record for record in records
+                       if record["seq"] > applied.get(record["writer"], 0)]
+            generation = snapshot["generation"] + 1
+            data = dict(snapshot, codes=[code.to_dict() for code in snapshot["codes"]],
+                        generation=generation)
+            atomic_write(self.index_path, json.dumps(data).encode("utf8"))
+            self._write_journal(generation, applied, pending)
+        return True
+
+    def save(self):
+        """他のインスタンスの変更を取り込んでからインデックスを書き込む（失敗時は例外を送出）"""
+        self.sync()
+        return self.write_snapshot(self.snapshot())
+
+    def migrate_legacy(self):
+        """
+        旧形式（Base64画像を含む単一JSON）を新形式に移行
+        画像を画像ストアに書き出してインデックスを保存し、旧ファイルは.bakとして残す
+        """
+        logger.info("旧形式のコードファイルを移行します: %s", self.config_path)
+        with open(self.config_path, "r") as f:
+            data = json.load(f)
+
+        codes = []
+        for code in data.get("codes", []):
+            if "image" not in code:
+                logger.warning("画像のないコードをスキップしました: %s", code.get("data"))
+                continue
+            entry = {key: value for key, value in code.items() if key != "image"}
+            entry["image_hash"] = self.image_store.put(base64.b64decode(code["image"]))
+            codes.append(CodeRecord.from_dict(entry))
+
+        self.codes = codes
+        self.current_index = data.get("current_index", 0)
+        self.save()
+
+        os.replace(self.config_path, self.config_path + ".bak")
+        logger.info("%d個のコードを移行しました", len(codes))
+
+    def build_code(self, data, name=None, symbology=DEFAULT_SYMBOLOGY):
+        """
+        コードのエントリを生成して作成
+        store_imagesが有効なら画像を画像ストアに書き込んでハッシュを保持し、
+        無効ならペイロードだけを保持してシンボルは描画キャッシュに載せる
+        """
+        if self.settings["store_images"]:
+            return self.make_code(data, name, image_to_png(generate_symbol(data, symbology)), symbology)
+
+        # 生成できることを確認し、表示時に再利用できるようにしておく
+        self.render_cache.get(data, symbology=symbology)
+        return self.make_code(data, name, symbology=symbology)
+
+    def make_code(self, data, name=None, png=None, symbology=DEFAULT_SYMBOLOGY):
+        """符号化済みのPNGからコードのエントリを作成（store_imagesが無効ならPNGは保存しない）"""
+        digest = None
+        if png is not None and self.settings["store_images"]:
+            digest = bytes.fromhex(self.image_store.put(png))
+        return CodeRecord(data, name, digest, symbology=symbology)
+
+    def content_key(self, code):
+        """
+        コードの画像内容を表すキー
+        画像を保存したコードはそのハッシュ、ペイロードのみのコードは (data, オプション[, シンボル体系])
+        """
+        if code.digest is not None:
+            return code.digest
+        return RenderCache.key(code.data, code.options, code.symbology)
+
+    def load_png(self, code):
+        """コードのPNG（ペイロードのみなら再生成したシンボル）を返す"""
+        if code.digest is not None:
+            return self.image_store.get(code.image_hash)
+        return self.render_cache.get(code.data, code.options, code.symbology)
+
+
+class CodeSets:
+    """
+    名前付きのコードセット（生産ラインごとの一覧など）
+    セットごとに別のインデックスファイルに保存し、開いたときに初めてロードする
+    最近使ったセットはCodeStoreのままLRUに保持し、切り替えで読み直さない
+    画像ストアは同じディレクトリを共有するので、セット間で同じ画像は一度だけ保存される
+
+    セットの一覧と最後に開いたセットは "<設定ファイル名>.sets.json" に保存する
+    既定のセットは従来の設定ファイルをそのまま使う
+    一覧はロックして書き込み、他のインスタンスが作成したセットは消さずに残す
+    """
+
+    # 既定のセットの名前（従来の単一の一覧）
+    DEFAULT_SET = "既定"
+    # メモリに保持するセットの最大数
+    CACHE_SIZE = 4
+
+    def __init__(self, config_path=None, cache_size=None):
+        """既定のセットの設定ファイルパス（省略時はユーザーごとのパス）を基準に初期化する"""
+        self.config_path = config_path or get_config_path()
+        self.cache_size = cache_size or self.CACHE_SIZE
+        # セット名 -> ファイル名の識別子（既定のセットは空文字）
+        self.sets = {self.DEFAULT_SET: ""}
+        self.current = self.DEFAULT_SET
+        self._resident = OrderedDict()
+        self.loads = 0
+        self.lock = FileLock(self.config_path[:-len(".json")] + ".sets.lock")
+        self._registry_mtime = None
+
+    @property
+    def registry_path(self):
+        """セットの一覧を保存するファイルのパス"""
+        return self.config_path[:-len(".json")] + ".sets.json"
+
+    @property
+    def names(self):
+        """セット名のリスト（作成順）"""
+        return list(self.sets)
+
+    def config_path_for(self, name):
+        """セットの設定ファイルパス（CodeStoreはここからインデックスのパスを決める）"""
+        key = self.sets[name]
+        if not key:
+            return self.config_path
+        return self.config_path[:-len(".json")] + f".{key}.json"
+
+    def _read_registry(self):
+        """（ロック中に）セットの一覧のファイルを読む（なければNone）"""
+        if not os.path.exists(self.registry_path):
+            return None
+        self._registry_mtime = os.stat(self.registry_path).st_mtime_ns
+        with open(self.registry_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load(self):
+        """セットの一覧を読み込む（各セットの中身はopenするまで読み込まない）"""
+        with self.lock:
+            data = self._read_registry()
+        if data is None:
+            return
+        self.sets = {self.DEFAULT_SET: ""}
+        self.sets.update(data.get("sets", {}))
+        if data.get("current") in self.sets:
+            self.current = data["current"]
+
+    def refresh(self):
+        """他のインスタンスが作成したセットを一覧に取り込み、増えたかを返す（ファイルが変わったときだけ読む）"""
+        return self.add_sets(self.read_new_sets())
+
+    def read_new_sets(self):
+        """
+        他のインスタンスが作成したセットを {セット名: 識別子} で返す（一覧は変更しない）
+        ファイルが変わっていなければ読まずに空の辞書を返す
+        """
+        try:
+            mtime = os.stat(self.registry_path).st_mtime_ns
+        except OSError:
+            return {}
+        if mtime == self._registry_mtime:
+            return {}
+        with self.lock:
+            data = self._read_registry() or {}
+        return {name: key for name, key in data.get("sets", {}).items() if name not in self.sets}
+
+    def add_sets(self, sets):
+        """read_new_setsで読んだセットを一覧に加え、増えたかを返す"""
+        added = {name: key for name, key in sets.items() if name not in self.sets}
+        self.sets.update(added)
+        return bool(added)
+
+    def snapshot(self):
+        """保存する内容の複製を返す"""
+        return {"version": 1, "sets": dict(self.sets), "current": self.current}
+
+    def write_snapshot(self, snapshot):
+        """snapshotの内容を、ファイルにだけあるセットを残してアトミックに書き込む（失敗時は例外を送出）"""
+        with self.lock:
+            data = self._read_registry() or {}
+            sets = dict(data.get("sets", {}))
+            sets.update(snapshot["sets"])
+            snapshot = dict(snapshot, sets=sets)
+            atomic_write(self.registry_path, json.dumps(snapshot, ensure_ascii=False).encode("utf8"))
+            self._registry_mtime = os.stat(self.registry_path).st_mtime_ns
+
+    def save(self):
+        """セットの一覧を書き込む（失敗時は例外を送出）"""
+        self.write_snapshot(self.snapshot())
+
+    def create(self, name):
+        """空のセットを作成してそのCodeStoreを返す（名前が空か重複していればValueError）"""
+        return self.add_created(*self.reserve(name))
+
+    def reserve(self, name):
+        """
+        セットを一覧のファイルに登録し、(セット名, ファイルにある全てのセット) を返す（一覧は変更しない）
+        名前が空か重複していればValueError。ファイルの読み書きだけなのでワーカースレッドで実行できる
+        """
+        name = name.strip()
+        if not name:
+            raise ValueError("セット名を入力してください")
+        if name in self.sets:
+            raise ValueError(f"セット「{name}」は既にあります")
+
+        # ファイル名にはセット名ではなく連番を使う（大文字小文字や記号の違いで衝突しないように）
+        # 他のインスタンスと同じ連番を使わないよう、ロックしたまま一覧を読み直して決め、すぐに書き込む
+        with self.lock:
+            data = self._read_registry() or {}
+            sets = dict(self.sets)
+            for other, key in data.get("sets", {}).items():
+                sets.setdefault(other, key)
+            if name in sets:
+                raise ValueError(f"セット「{name}」は既にあります")
+            number = len(sets)
+            while f"set{number}" in sets.values():
+                number += 1
+            sets[name] = f"set{number}"
+            self.write_snapshot(dict(self.snapshot(), sets=sets))
+        return name, sets
+
+    def add_created(self, name, sets):
+        """reserveで登録したセットを一覧に加え、その空のCodeStoreを返す"""
+        self.add_sets(sets)
+        store = CodeStore(self.config_path_for(name))
+        store.apply_settings()
+        self.remember(name, store)
+        return store
+
+    def open(self, name):
+        """
+        セットのCodeStoreを返す
+        LRUに残っていればそのまま返し、なければインデックスファイルをロードする
+        LRUから外れるセットは保存済みである必要がある（呼び出し側が切り替え前に保存する）
+        """
+        store = self.cached(name)
+        if store is None:
+            store = self.load_store(name)
+            self.remember(name, store)
+        return store
+
+    def cached(self, name):
+        """LRUに残っているセットのCodeStore（なければNone）"""
+        store = self._resident.get(name)
+        if store is not None:
+            self._resident.move_to_end(name)
+        return store
+
+    def load_store(self, name):
+        """セットのインデックスファイルをロードしたCodeStoreを返す（LRUには登録しないのでワーカースレッドで実行できる）"""
+        store = CodeStore(self.config_path_for(name))
+        with span("set_load"):
+            store.load()
+        self.loads += 1
+        return store
+
+    def remember(self, name, store):
+        """セット（load_storeでロードしたものなど）をLRUに登録し、上限を超えた古いセットを手放す"""
+        self._resident[name] = store
+        self._resident.move_to_end(name)
+        while len(self._resident) > self.cache_size:
+            evicted, _ = self._resident.popitem(last=False)
+            logger.debug("コードセットをメモリから解放しました: %s", evicted)
+
+    def resident(self):
+        """メモリに保持しているセット名（古い順）"""
+        return list(self._resident)
@@ -0,0 +1,500 @@
+"""
+Data Matrix（ECC200）エンコーダーのバックエンド
+  pylibdmtx: ネイティブのlibdmtxを使う（libdmtxがインストールされている場合）
+  numpy    : NumPyで実装したECC200エンコーダー（libdmtxがない環境でも使える）
+起動時に利用できるバックエンドを簡単に計測し、速い方を選ぶ（DATAMATRIX_ENCODERで固定できる）
+
+numpyバックエンドはlibdmtxの既定（ASCIIエンコード、正方形のサイズ自動選択、
+モジュール5ピクセル、余白10ピクセル）と同じシンボルを生成する
+"""
+import logging
+import os
+import time
+from functools import lru_cache
+
+from datamatrix_instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# バックエンドを固定する環境変数（自動選択の結果も子プロセスに引き継ぐためここに書き込む）
+ENCODER_ENV = "DATAMATRIX_ENCODER"
+
+# 自動選択の計測に使うペイロード（短い品番から長めの文字列まで）
+SELF_BENCHMARK_PAYLOADS = (b"12345678", b"LOT-000123-ABCDEF", b"https://example.com/item/0123456789")
+SELF_BENCHMARK_ROUNDS = 3
+
+# libdmtxの既定の描画サイズ（ピクセル）
+MODULE_SIZE = 5
+MARGIN_SIZE = 10
+
+# GF(256)の原始多項式 x^8 + x^5 + x^3 + x^2 + 1（ECC200の規定）
+GF_POLYNOMIAL = 301
+
+# 正方形シンボルの仕様: (一辺のモジュール数, データ領域の一辺, データ語数, 誤り訂正語数, ブロック数)
+SQUARE_SYMBOLS = (
+    (10, 8, 3, 5, 1),
+    (12, 10, 5, 7, 1),
+    (14, 12, 8, 10, 1),
+    (16, 14, 12, 12, 1),
+    (18, 16, 18, 14, 1),
+    (20, 18, 22, 18, 1),
+    (22, 20, 30, 20, 1),
+    (24, 22, 36, 24, 1),
+    (26, 24, 44, 28, 1),
+    (32, 14, 62, 36, 1),
+    (36, 16, 86, 42, 1),
+    (40, 18, 114, 48, 1),
+    (44, 20, 144, 56, 1),
+    (48, 22, 174, 68, 1),
+    (52, 24, 204, 84, 2),
+    (64, 14, 280, 112, 2),
+    (72, 16, 368, 144, 4),
+    (80, 18, 456, 192, 4),
+    (88, 20, 576, 224, 4),
+    (96, 22, 696, 272, 4),
+    (104, 24, 816, 336, 6),
+    (120, 18, 1050, 408, 6),
+    (132, 20, 1304, 496, 8),
+    (144, 22, 1558, 620, 10),
+)
+
+
+class EncoderBackend:
+    """エンコーダーのバックエンドの共通インターフェース"""
+
+    name = None
+
+    def available(self):
+        """このバックエンドを使えるか（初回は依存モジュールの読み込みを伴う）"""
+        raise NotImplementedError
+
+    def supports(self, options):
+        """optionsで指定された符号化方式・サイズに対応しているか"""
+        return True
+
+    def encode(self, data, **options):
+        """バイト列を符号化してRGBのPIL画像を返す"""
+        raise NotImplementedError
+
+
+class PylibdmtxBackend(EncoderBackend):
+    """pylibdmtx（ネイティブのlibdmtx）による符号化。optionsはpylibdmtx.encodeにそのまま渡す"""
+
+    name = "pylibdmtx"
+
+    def __init__(self):
+        self._module = None
+        self._checked = False
+
+    def load(self):
+        """pylibdmtxを初回使用時にインポートして返す（利用できなければNone）"""
+        if not self._checked:
+            with span("import_encoder"):
+                try:
+                    from pylibdmtx import pylibdmtx
+                    self._module = pylibdmtx
+                except ImportError as e:
+                    logger.debug("pylibdmtxを読み込めません: %s", e)
+            self._checked = True
+        return self._module
+
+    def available(self):
+        return self.load() is not None
+
+    def encode(self, data, **options):
+        from PIL import Image
+
+        encoded = self.load().encode(data, **options)
+        return Image.frombytes("RGB", (encoded.width, encoded.height), encoded.pixels)
+
+
+class NumpyBackend(EncoderBackend):
+    """
+    NumPyによるECC200の符号化
+    - リードソロモン符号はデータ語の数ごとに係数行列を作っておき、GF(256)の行列積で一度に求める
+    - モジュールの配置はシンボルサイズごとに配置表（コード語の番号とビット位置の配列）を作っておき、
+      配列の添字参照で一度に並べる
+    対応するのはASCIIエンコードと正方形のシンボルのみ
+    """
+
+    name = "numpy"
+
+    def __init__(self):
+        self._available = None
+
+    def available(self):
+        if self._available is None:
+            try:
+                # 規格の例（"123456" → 10x10）と誤り訂正語が一致するか確認してから使う（numpyがなければImportError）
+                self._available = self_check()
+                if not self._available:
+                    logger.warning("numpyエンコーダーの自己検査に失敗したため使用しません")
+            except ImportError as e:
+                logger.debug("numpyを読み込めません: %s", e)
+                self._available = False
+        return self._available
+
+    def supports(self, options):
+        scheme = options.get("scheme")
+        size = options.get("size")
+        return (scheme in (None, "Ascii")
+                and (size in (None, "SquareAuto") or symbol_for_size_name(size) is not None))
+
+    def encode(self, data, **options):
+        return render_modules(encode_modules(data, options.get("size")))
+
+
+def ascii_codewords(data):
+    """ASCIIエンコード（数字2桁は1語にまとめ、128以上はUpper Shiftを付ける）"""
+    codewords = []
+    i, length = 0, len(data)
+    while i < length:
+        value = data[i]
+        if 48 <= value <= 57 and i + 1 < length and 48 <= data[i + 1] <= 57:
+            codewords.append(130 + (value - 48) * 10 + (data[i + 1] - 48))
+            i += 2
+        elif value < 128:
+            codewords.append(value + 1)
+            i += 1
+        else:
+            codewords.extend((235, value - 127))
+            i += 1
+    return codewords
+
+
+def pad_codewords(codewords, capacity):
+    """シンボルの容量まで埋め草を追加（2つ目以降は位置に応じた253状態の乱数化）"""
+    codewords = list(codewords)
+    if len(codewords) < capacity:
+        codewords.append(129)
+    while len(codewords) < capacity:
+        position = len(codewords) + 1
+        value = 129 + (149 * position) % 253 + 1
+        codewords.append(value - 254 if value > 254 else value)
+    return codewords
+
+
+def symbol_for_size_name(name):
+    """"12x12" のようなサイズ名に対応する正方形シンボルの仕様（なければNone）"""
+    for symbol in SQUARE_SYMBOLS:
+        if name == f"{symbol[0]}x{symbol[0]}":
+            return symbol
+    return None
+
+
+def choose_symbol(count, size=None):
+    """データ語数が収まる最小の正方形シンボル（sizeを指定した場合はそのサイズ）"""
+    if size not in (None, "SquareAuto"):
+        symbol = symbol_for_size_name(size)
+        if symbol is None or symbol[2] < count:
+            raise ValueError(f"データがシンボルサイズ {size} に収まりません")
+        return symbol
+    for symbol in SQUARE_SYMBOLS:
+        if symbol[2] >= count:
+            return symbol
+    raise ValueError(f"データが長すぎます（{count}語、最大{SQUARE_SYMBOLS[-1][2]}語）")
+
+
+@lru_cache(maxsize=1)
+def gf_tables():
+    """GF(256)の指数表・対数表と、全ての積の表（256x256）"""
+    import numpy as np
+
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+    value = 1
+    for i in range(255):
+        exp[i] = value
+        log[value] = i
+        value <<= 1
+        if value & 0x100:
+            value ^= GF_POLYNOMIAL
+    exp[255:510] = exp[:255]
+
+    a = np.arange(256)
+    product = exp[(log[a][:, None] + log[a][None, :]) % 255]
+    product[0, :] = 0
+    product[:, 0] = 0
+    return exp, log, product.astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def rs_generator(ecc_count):
+    """誤り訂正語数ecc_countの生成多項式の係数（最高次の1を除き、高次から順）"""
+    import numpy as np
+
+    exp, _, product = gf_tables()
+    generator = np.array([1], dtype=np.uint8)
+    for i in range(1, ecc_count + 1):
+        # (x - α^i) を掛ける（GF(2^8)では減算も排他的論理和）
+        shifted = np.append(generator, 0).astype(np.uint8)
+        scaled = np.insert(product[generator, exp[i]], 0, 0).astype(np.uint8)
+        generator = shifted ^ scaled
+    return generator[1:]
+
+
+@lru_cache(maxsize=None)
+def rs_matrix(data_count, ecc_count):
+    """
+    データ語から誤り訂正語を求める係数行列（data_count x ecc_count）
+    誤り訂正語はデータ語について線形なので、j番目のデータ語だけが1のときの剰余をj行目とする
+    """
+    import numpy as np
+
+    _, _, product = gf_tables()
+    generator = rs_generator(ecc_count)
+    matrix = np.zeros((data_count, ecc_count), dtype=np.uint8)
+    remainder = np.zeros(ecc_count, dtype=np.uint8)
+    # x^(ecc_count) mod g から始めて、x倍ずつ剰余を求める（最後のデータ語から順に行を埋める）
+    feedback = 1
+    for j in range(data_count - 1, -1, -1):
+        remainder = np.append(remainder[1:], 0).astype(np.uint8) ^ product[feedback, generator]
+        matrix[j] = remainder
+        feedback = int(remainder[0])
+    return matrix
+
+
+def rs_encode(blocks, ecc_count):
+    """
+    ブロックごとのデータ語（blocks x データ語数の配列）の誤り訂正語を求める
+    GF(256)の行列積: 積の表を引いて、データ語方向に排他的論理和で畳み込む
+    """
+    import numpy as np
+
+    _, _, product = gf_tables()
+    matrix = rs_matrix(blocks.shape[1], ecc_count)
+    return np.bitwise_xor.reduce(product[blocks[:, :, None], matrix[None, :, :]], axis=1)
+
+
+def rs_codewords(data, ecc_count, block_count):
+    """データ語に誤り訂正語を付けた全コード語（複数ブロックはインターリーブする）"""
+    import numpy as np
+
+    data = np.asarray(data, dtype=np.uint8)
+    data_per_block = -(-len(data) // block_count)
+    # 144x144では先頭のブロックだけ1語多いので、短いブロックは先頭に0を補う（剰余は変わらない）
+    blocks = np.zeros((block_count, data_per_block), dtype=np.uint8)
+    for block in range(block_count):
+        words = data[block::block_count]
+        blocks[block, data_per_block - len(words):] = words
+    ecc = rs_encode(blocks, ecc_count // block_count)
+    return np.concatenate([data, ecc.T.reshape(-1)])
+
+
+@lru_cache(maxsize=None)
+def placement(rows, columns):
+    """
+    データ領域（rows x columns）のモジュール配置表
+    戻り値は (コード語の番号の配列, ビットのシフト量の配列, 固定で黒にするモジュールの配列)
+    どのコード語にも使われない右下の隅のモジュールは番号-1（白）になる
+    """
+    import numpy as np
+
+    codeword = np.full((rows, columns), -1, dtype=np.int32)
+    shift = np.zeros((rows, columns), dtype=np.int32)
+
+    def module(row, col, index, bit):
+        if row < 0:
+            row += rows
+            col += 4 - ((rows + 4) % 8)
+        if col < 0:
+            col += columns
+            row += 4 - ((columns + 4) % 8)
+        codeword[row, col] = index
+        shift[row, col] = 8 - bit
+
+    def utah(row, col, index):
+        for bit, (dr, dc) in enumerate(((-2, -2), (-2, -1), (-1, -2), (-1, -1),
+                                        (-1, 0), (0, -2), (0, -1), (0, 0)), start=1):
+            module(row + dr, col + dc, index, bit)
+
+    def corner(positions, index):
+        for bit, (row, col) in enumerate(positions, start=1):
+            module(row, col, index, bit)
+
+    r, c = rows, columns
+    corners = (
+        lambda: ((r - 1, 0), (r - 1, 1), (r - 1, 2), (0, c - 2), (0, c - 1), (1, c - 1), (2, c - 1), (3, c - 1)),
+        lambda: ((r - 3, 0), (r - 2, 0), (r - 1, 0), (0, c - 4), (0, c - 3), (0, c - 2), (0, c - 1), (1, c - 1)),
+        lambda: ((r - 3, 0), (r - 2, 0), (r - 1, 0), (0, c - 2), (0, c - 1), (1, c - 1), (2, c - 1), (3, c - 1)),
+        lambda: ((r - 1, 0), (r - 1, c - 1), (0, c - 3), (0, c - 2), (0, c - 1), (1, c - 3), (1, c - 2), (1, c - 1)),
+    )
+
+    index, row, col = 0, 4, 0
+    while True:
+        if row == rows and col == 0:
+            corner(corners[0](), index)
+            index += 1
+        if row == rows - 2 and col == 0 and columns % 4:
+            corner(corners[1](), index)
+            index += 1
+        if row == rows - 2 and col == 0 and columns % 8 == 4:
+            corner(corners[2](), index)
+            index += 1
+        if row == rows + 4 and col == 2 and not columns % 8:
+            corner(corners[3](), index)
+            index += 1
+
+        # 右上に向かって斜めに配置
+        while True:
+            if row < rows and col >= 0 and codeword[row, col] == -1:
+                utah(row, col, index)
+                index += 1
+            row -= 2
+            col += 2
+            if not (row >= 0 and col < columns):
+                break
+        row += 1
+        col += 3
+
+        # 左下に向かって斜めに配置
+        while True:
+            if row >= 0 and col < columns and codeword[row, col] == -1:
+                utah(row, col, index)
+                index += 1
+            row += 2
+            col -= 2
+            if not (row < rows and col >= 0):
+                break
+        row += 3
+        col += 1
+
+        if not (row < rows or col < columns):
+            break
+
+    # 右下の隅が埋まらないサイズでは、規定どおり対角の2モジュールを黒にする
+    fixed = np.zeros((rows, columns), dtype=bool)
+    if codeword[rows - 1, columns - 1] == -1:
+        fixed[rows - 1, columns - 1] = fixed[rows - 2, columns - 2] = True
+    return codeword, shift, fixed
+
+
+@lru_cache(maxsize=None)
+def symbol_layout(size, region):
+    """
+    シンボル全体の固定パターン（各データ領域のL字のファインダーと点線のタイミング）と、
+    データ領域の行・列がシンボルのどの行・列に対応するか
+    """
+    import numpy as np
+
+    pattern = np.zeros((size, size), dtype=bool)
+    step = region + 2
+    for top in range(0, size, step):
+        for left in range(0, size, step):
+            pattern[top, left:left + step:2] = True                 # 上端: 点線
+            pattern[top + 1:top + step:2, left + step - 1] = True   # 右端: 点線
+            pattern[top:top + step, left] = True                    # 左端: 実線
+            pattern[top + step - 1, left:left + step] = True        # 下端: 実線
+
+    cells = np.arange(size - 2 * (size // step))
+    lines = cells + 1 + 2 * (cells // region)
+    return pattern, lines
+
+
+def encode_modules(data, size=None):
+    """バイト列をECC200で符号化し、モジュールの行列（Trueが黒）を返す"""
+    import numpy as np
+
+    codewords = ascii_codewords(data)
+    symbol_size, region, data_count, ecc_count, block_count = choose_symbol(len(codewords), size)
+    codewords = rs_codewords(pad_codewords(codewords, data_count), ecc_count, block_count)
+
+    pattern, lines = symbol_layout(symbol_size, region)
+    index, shift, fixed = placement(len(lines), len(lines))
+    # 番号-1（使われない隅）は末尾に足した0を参照して白にする
+    words = np.append(codewords, 0).astype(np.int32)
+    bits = ((words[index] >> shift) & 1).astype(bool) | fixed
+
+    matrix = pattern.copy()
+    matrix[np.ix_(lines, lines)] = bits
+    return matrix
+
+
+def render_modules(modules, module_size=MODULE_SIZE, margin=MARGIN_SIZE):
+    """モジュールの行列をlibdmtxと同じ寸法のRGB画像にする（黒モジュールに白の余白）"""
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.where(np.kron(modules, np.ones((module_size, module_size), dtype=bool)), 0, 255)
+    pixels = np.pad(pixels.astype(np.uint8), margin, constant_values=255)
+    return Image.fromarray(pixels, "L").convert("RGB")
+
+
+def self_check():
+    """規格の符号化例（"123456" のデータ語と誤り訂正語）と一致するか"""
+    codewords = pad_codewords(ascii_codewords(b"123456"), 3)
+    return rs_codewords(codewords, 5, 1).tolist() == [142, 164, 186, 114, 25, 5, 88, 102]
+
+
+# 登録されているバックエンド（自動選択で同じ速さなら先に登録した方を選ぶ）
+BACKENDS = {backend.name: backend for backend in (PylibdmtxBackend(), NumpyBackend())}
+
+_selected = None
+
+
+def benchmark_backend(backend, payloads=SELF_BENCHMARK_PAYLOADS, rounds=SELF_BENCHMARK_ROUNDS):
+    """payloadsを符号化する時間の最良値（秒）。符号化できなければNone"""
+    best = None
+    try:
+        # 初回はキャッシュの作成などを含むので計測しない
+        for data in payloads:
+            backend.encode(data)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for data in payloads:
+                backend.encode(data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    except Exception as e:
+        logger.warning("エンコーダー %s の計測に失敗しました: %s", backend.name, e)
+        return None
+    return best
+
+
+def select_backend():
+    """
+    使用するバックエンドを決める
+    DATAMATRIX_ENCODERで指定されていればそれを使い、なければ利用できるものを計測して速い方を選ぶ
+    選んだ結果は環境変数に書き込み、一括符号化の子プロセスでは計測し直さない
+    """
+    forced = os.environ.get(ENCODER_ENV)
+    if forced:
+        backend = BACKENDS.get(forced)
+        if backend is not None and backend.available():
+            return backend
+        logger.warning("%s=%s のエンコーダーは利用できません。自動で選択します", ENCODER_ENV, forced)
+
+    candidates = [backend for backend in BACKENDS.values() if backend.available()]
+    if not candidates:
+        return None
+
+    with span("encoder_self_benchmark"):
+        results = {backend.name: benchmark_backend(backend) for backend in candidates}
+    measured = [backend for backend in candidates if results[backend.name] is not None]
+    if not measured:
+        return None
+    backend = min(measured, key=lambda b: results[b.name])
+    logger.info("エンコーダーに %s を使用します（計測: %s）", backend.name,
+                ", ".join(f"{name} {seconds * 1000:.2f} ms" for name, seconds in results.items()
+                          if seconds is not None))
+    os.environ[ENCODER_ENV] = backend.name
+    return backend
+
+
+def get_backend():
+    """選択済みのバックエンド（初回は選択を行う。利用できなければNone）"""
+    global _selected
+    if _selected is None:
+        _selected = select_backend()
+    return _selected
+
+
+def backend_for(options):
+    """optionsに対応するバックエンド（選択済みのものが対応していなければ他の利用できるもの）"""
+    backend = get_backend()
+    if backend is None or backend.supports(options):
+        return backend
+    for candidate in BACKENDS.values():
+        if candidate.supports(options) and candidate.available():
+            return candidate
+    raise ValueError(f"指定されたオプションに対応するエンコーダーがありません: {options}")
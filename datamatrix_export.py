@@ -0,0 +1,406 @@
+"""
+Data Matrixコード（とQRコード）の書き出し（PNG / SVG / 複数ページのシート）
+datamatrix_coreと同様にtkinterに依存しない
+"""
+import os
+import zlib
+from functools import lru_cache, partial
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from datamatrix_core import (
+    DEFAULT_SYMBOLOGY,
+    QR_QUIET_ZONE,
+    bulk_encode,
+    encode_payload,
+    generate_datamatrix,
+    qr_modules,
+)
+
+# 書き出し形式と拡張子
+OUTPUT_FORMATS = {"png": ".png", "svg": ".svg", "sheet": ".pdf"}
+
+# 印刷用シートの出力形式（pdfは1ファイル、pngはページごとのファイル）
+SHEET_FORMATS = ("pdf", "png")
+
+# PDFの1インチあたりのポイント数
+POINTS_PER_INCH = 72
+MM_PER_INCH = 25.4
+
+# キャプションのフォントの候補（日本語を表示できるものを優先。見つからなければPILの既定のフォント）
+CAPTION_FONTS = ("msgothic.ttc", "meiryo.ttc", "YuGothM.ttc", "NotoSansCJK-Regular.ttc",
+                 "ipaexg.ttf", "DejaVuSans.ttf")
+
+
+def image_to_modules(img):
+    """
+    シンボル画像からモジュール（セル）の行列を復元する
+    戻り値は行ごとのboolのリスト（Trueが黒）
+    """
+    gray = img.convert("L")
+    # 黒い部分の範囲（クワイエットゾーンを除いたシンボル本体）
+    bbox = gray.point(lambda v: 255 if v < 128 else 0).getbbox()
+    if bbox is None:
+        return []
+    left, top, right, bottom = bbox
+
+    # 上端のタイミングパターンの最初の黒の幅がモジュールサイズ
+    module = 1
+    while left + module < right and gray.getpixel((left + module, top)) < 128:
+        module += 1
+
+    columns = (right - left) // module
+    rows = (bottom - top) // module
+    half = module // 2
+    return [
+        [gray.getpixel((left + x * module + half, top + y * module + half)) < 128
+         for x in range(columns)]
+        for y in range(rows)
+    ]
+
+
+def modules_to_svg(modules, module_size=10, quiet_zone=2):
+    """モジュールの行列をSVG文字列に変換（黒モジュールを1つのpathにまとめる）"""
+    rows = len(modules)
+    columns = len(modules[0]) if modules else 0
+    width = (columns + quiet_zone * 2) * module_size
+    height = (rows + quiet_zone * 2) * module_size
+
+    path = []
+    for y, row in enumerate(modules):
+        x = 0
+        while x < columns:
+            if not row[x]:
+                x += 1
+                continue
+            # 横に連続する黒モジュールを1つの矩形にする
+            start = x
+            while x < columns and row[x]:
+                x += 1
+            path.append(f"M{start + quiet_zone},{y + quiet_zone}h{x - start}v1h{start - x}z")
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {columns + quiet_zone * 2} {rows + quiet_zone * 2}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(path)}"/></svg>\n'
+    )
+
+
+def encode_svg(data, symbology=DEFAULT_SYMBOLOGY):
+    """プロセスプール用: ペイロードを符号化し (data, SVG文字列, エラー) を返す"""
+    try:
+        if symbology == "qr":
+            # QRコードは符号化結果のモジュールをそのまま使い、余白は規格のクワイエットゾーンにする
+            return data, modules_to_svg(qr_modules(data), quiet_zone=QR_QUIET_ZONE), None
+        if symbology != DEFAULT_SYMBOLOGY:
+            raise ValueError(f"未対応のシンボル体系です: {symbology}")
+        return data, modules_to_svg(image_to_modules(generate_datamatrix(data))), None
+    except Exception as e:
+        return data, None, str(e)
+
+
+class SheetLayout:
+    """印刷用シートのレイアウト（A4縦、コードを格子状に並べ、下にキャプションを付ける）"""
+
+    def __init__(self, dpi=150, columns=4, rows=6, margin_mm=10, page_mm=(210, 297), caption_pt=8):
+        """解像度、格子の列数・行数、余白、キャプションの文字の大きさ（ポイント）を指定して初期化する"""
+        self.dpi = dpi
+        self.columns = columns
+        self.rows = rows
+        self.page_size = tuple(int(mm / MM_PER_INCH * dpi) for mm in page_mm)
+        self.margin = int(margin_mm / MM_PER_INCH * dpi)
+        self.caption_size = max(1, round(caption_pt / POINTS_PER_INCH * dpi))
+
+    @property
+    def caption_height(self):
+        """キャプション1行分の高さ（ピクセル、行間を含む）"""
+        return self.caption_size + self.caption_size // 2
+
+    @property
+    def per_page(self):
+        """1ページに並べるコードの数"""
+        return self.columns * self.rows
+
+    @property
+    def cell_size(self):
+        """1コードあたりのセルの大きさ（ピクセル）"""
+        width, height = self.page_size
+        return ((width - self.margin * 2) // self.columns,
+                (height - self.margin * 2) // self.rows)
+
+    @property
+    def page_points(self):
+        """PDFのページサイズ（ポイント）"""
+        return tuple(px * POINTS_PER_INCH / self.dpi for px in self.page_size)
+
+
+@lru_cache(maxsize=8)
+def caption_font(size):
+    """キャプション用のsizeピクセルのフォント（プロセスごとに一度だけ読み込む）"""
+    for name in CAPTION_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # 大きさを指定できない古いPIL
+        return ImageFont.load_default()
+
+
+def fit_caption(text, font, width):
+    """widthピクセルに収まるよう、はみ出す分を「…」にしたキャプション"""
+    # 収まる最長の長さを、収まらなくなるまで長さを倍にしてから二分探索で求める
+    # （ペイロードは数千文字になりうるので、1文字ずつ削って全体を測り直したり、長い文字列を測ったりしない）
+    low, high = 0, 1
+    while high < len(text) and font.getlength(text[:high] + "…") <= width:
+        low, high = high, high * 2
+    # 収まらなかった長さの倍より長ければ全体も収まらないので、全体は短いときだけ測る
+    if len(text) <= high * 2 and font.getlength(text) <= width:
+        return text
+    high = min(high, len(text)) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if font.getlength(text[:middle] + "…") <= width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…"
+
+
+def compose_page(pngs, layout, captions=None):
+    """
+    コードのPNGをレイアウトに従って1ページに並べたグレースケール画像を返す
+    captionsを指定すると、各コードの下にその文字列（dataなど）を書く
+    """
+    page = Image.new("L", layout.page_size, 255)
+    cell_width, cell_height = layout.cell_size
+    caption_height = layout.caption_height if captions else 0
+    if captions:
+        draw = ImageDraw.Draw(page)
+        font = caption_font(layout.caption_size)
+    for i, png in enumerate(pngs):
+        img = Image.open(BytesIO(png)).convert("L")
+        # セルに収まる最大の整数倍で拡大（最近傍）してモジュールをぼかさない
+        scale = max(1, min(cell_width // img.width, (cell_height - caption_height) // img.height))
+        if scale > 1:
+            img = img.resize((img.width * scale, img.height * scale), Image.NEAREST)
+        col, row = i % layout.columns, i // layout.columns
+        left = layout.margin + col * cell_width
+        x = left + (cell_width - img.width) // 2
+        y = layout.margin + row * cell_height + (cell_height - caption_height - img.height) // 2
+        page.paste(img, (x, y))
+        if captions:
+            # シンボルの余白（クワイエットゾーン）のすぐ下に中央揃えで書く
+            text = fit_caption(captions[i], font, cell_width - layout.caption_size)
+            text_x = left + (cell_width - font.getlength(text)) / 2
+            draw.text((text_x, y + img.height), text, fill=0, font=font)
+    return page
+
+
+def render_sheet_page(task):
+    """
+    プロセスプール用: 1ページ分の (PNGのリスト, キャプションのリスト, レイアウト, 出力形式) を合成する
+    pngはPNGのバイト列、pdfは (幅, 高さ, 圧縮したグレースケールの画素) を返す
+    """
+    pngs, captions, layout, fmt = task
+    page = compose_page(pngs, layout, captions)
+    if fmt == "png":
+        buffered = BytesIO()
+        page.save(buffered, format="PNG", dpi=(layout.dpi, layout.dpi))
+        return buffered.getvalue()
+    return page.width, page.height, zlib.compress(page.tobytes())
+
+
+def sheet_page_path(output, number):
+    """PNGのシートのnページ目のパス（sheet.png → sheet-0001.png）"""
+    base, ext = os.path.splitext(output)
+    return f"{base}-{number:04d}{ext or '.png'}"
+
+
+def code_sheet_items(store, codes, errors):
+    """
+    storeのcodesを (PNG, キャプション) として順に返すジェネレータ（write_sheets用、キャプションはdata）
+    画像を読み込めないコードは飛ばし、(コード, エラーメッセージ) をerrorsに追加する
+    """
+    for code in codes:
+        try:
+            png = store.load_png(code)
+        except Exception as e:
+            errors.append((code, str(e)))
+            continue
+        yield png, code.data
+
+
+def write_sheets(items, output, fmt="pdf", layout=None, jobs=None, on_page=None):
+    """
+    (PNG, キャプション) を順に並べた印刷用シートを書き出し、書き出したページ数を返す
+    ページの合成はプロセスプールで並列に行い、合成が終わったページから順にディスクへ書き出す
+    itemsはイテレータでよく、合成中の数ページ分しかメモリに載せないので、コード数が増えてもメモリ使用量は一定
+    fmt: "pdf" はoutputに複数ページのPDF、"png" はページごとのPNG（sheet_page_pathを参照）
+    on_pageは1ページ書き出すごとに書き出したページ数で呼ばれる
+    """
+    if fmt not in SHEET_FORMATS:
+        raise ValueError(f"未対応のシートの形式です: {fmt}")
+    layout = layout or SheetLayout()
+
+    def tasks():
+        """itemsを1ページ分ずつにまとめる"""
+        pngs, captions = [], []
+        for png, caption in items:
+            pngs.append(png)
+            captions.append(caption)
+            if len(pngs) == layout.per_page:
+                yield pngs, captions, layout, fmt
+                pngs, captions = [], []
+        if pngs:
+            yield pngs, captions, layout, fmt
+
+    pages = bulk_encode(tasks(), jobs=jobs, chunksize=1, worker=render_sheet_page)
+    count = 0
+    if fmt == "png":
+        for png in pages:
+            count += 1
+            with open(sheet_page_path(output, count), "wb") as f:
+                f.write(png)
+            if on_page is not None:
+                on_page(count)
+        return count
+
+    with PdfSheetWriter(output, layout) as writer:
+        for width, height, data in pages:
+            writer.add_compressed_page(width, height, data)
+            count += 1
+            if on_page is not None:
+                on_page(count)
+    return count
+
+
+class PdfSheetWriter:
+    """
+    ページ画像を1ページずつPDFに書き出すライター
+    書き出したページは保持しないので、ページ数が増えてもメモリ使用量は一定
+    """
+
+    def __init__(self, path, layout):
+        """出力先とレイアウトを指定してPDFのヘッダーを書き込む"""
+        self.layout = layout
+        self.file = open(path, "wb")
+        self.offsets = {}
+        self.page_ids = []
+        # 1: カタログ、2: ページツリー（最後に書き込む）
+        self.next_id = 3
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_object(self, obj_id, body, stream=None):
+        """オブジェクトを書き込み、xref用にオフセットを記録する"""
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n".encode("ascii"))
+        self.file.write(body.encode("ascii"))
+        if stream is not None:
+            self.file.write(b"\nstream\n")
+            self.file.write(stream)
+            self.file.write(b"\nendstream")
+        self.file.write(b"\nendobj\n")
+
+    def add_page(self, page):
+        """グレースケールのページ画像を1ページとして書き込む"""
+        self.add_compressed_page(page.width, page.height, zlib.compress(page.tobytes()))
+
+    def add_compressed_page(self, width, height, data):
+        """zlibで圧縮済みのグレースケールの画素（別プロセスで合成したページなど）を1ページとして書き込む"""
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        width_pt, height_pt = self.layout.page_points
+
+        self._write_object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>"
+        ), data)
+
+        content = f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode("ascii")
+        self._write_object(content_id, f"<< /Length {len(content)} >>", content)
+
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ))
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """ページツリーとxrefを書き込んでファイルを閉じる"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>")
+        self._write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_id}\n".encode("ascii"))
+        self.file.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, self.next_id):
+            self.file.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode("ascii"))
+        self.file.write(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\n"
+                        f"startxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def render_batch(payloads, fmt, output, jobs=None, layout=None, on_result=None,
+                 symbology=DEFAULT_SYMBOLOGY):
+    """
+    ペイロードを符号化して書き出す
+    fmt: "png" / "svg" はoutputディレクトリに1コード1ファイル（対応表はindex.tsv）、
+         "sheet" はoutputにdataをキャプションにした複数ページのPDF（outputが.pngならページごとのPNG）を書き出す
+    symbology: 全てのペイロードに使うシンボル体系（"datamatrix" / "qr"）
+    on_resultは1件処理するごとに (data, エラー) で呼ばれる
+    戻り値は (成功数, 失敗のリスト)
+    """
+    worker = encode_svg if fmt == "svg" else encode_payload
+    if symbology != DEFAULT_SYMBOLOGY:
+        worker = partial(worker, symbology=symbology)
+    results = bulk_encode(payloads, jobs=jobs, worker=worker)
+    written, errors = 0, []
+
+    if fmt == "sheet":
+        def items():
+            """符号化できたものから順に (PNG, キャプション) を渡す"""
+            nonlocal written
+            for data, png, error in results:
+                if on_result is not None:
+                    on_result(data, error)
+                if error is not None:
+                    errors.append((data, error))
+                    continue
+                written += 1
+                yield png, data
+
+        sheet_format = "png" if output.lower().endswith(".png") else "pdf"
+        write_sheets(items(), output, sheet_format, layout, jobs=jobs)
+        return written, errors
+
+    os.makedirs(output, exist_ok=True)
+    extension = OUTPUT_FORMATS[fmt]
+    with open(os.path.join(output, "index.tsv"), "w", encoding="utf-8") as index:
+        for data, result, error in results:
+            if on_result is not None:
+                on_result(data, error)
+            if error is not None:
+                errors.append((data, error))
+                continue
+            written += 1
+            filename = f"{written:06d}{extension}"
+            if fmt == "svg":
+                with open(os.path.join(output, filename), "w", encoding="utf-8") as f:
+                    f.write(result)
+            else:
+                with open(os.path.join(output, filename), "wb") as f:
+                    f.write(result)
+            index.write(f"{filename}\t{data}\n")
+    return written, errors
@@ -0,0 +1,120 @@
+"""
+ログ出力と処理時間の計測
+計測は既定で無効（DATAMATRIX_TIMING=1 または --timing で有効）で、
+無効な間のspanは何もしないコンテキストを返すだけなのでホットパスに置いても負担にならない
+"""
+import atexit
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    """区間の所要時間をTimingsに記録するコンテキスト"""
+
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.name, time.perf_counter() - self.start)
+
+
+class Timings:
+    """区間名ごとの所要時間を集計する"""
+
+    def __init__(self):
+        """計測を無効な状態で初期化する"""
+        self.enabled = False
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def span(self, name):
+        """with文で囲んだ区間の所要時間を記録する（無効なら何もしない）"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, seconds):
+        """所要時間を1件記録する"""
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def reset(self):
+        """記録を全て破棄する"""
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """区間ごとの件数、合計、p50、p95、最大（秒）を返す"""
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+
+        def percentile(values, ratio):
+            return values[min(len(values) - 1, int(len(values) * ratio))]
+
+        return {
+            name: {
+                "count": len(values),
+                "total": sum(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "max": values[-1],
+            }
+            for name, values in samples.items()
+        }
+
+    def report(self):
+        """集計結果を表形式の文字列にする（単位はミリ秒）"""
+        lines = [f"{'span':<20} {'count':>7} {'total':>10} {'p50':>9} {'p95':>9} {'max':>9}"]
+        for name, s in sorted(self.summary().items()):
+            lines.append(f"{name:<20} {s['count']:>7} {s['total'] * 1000:>10.2f} "
+                         f"{s['p50'] * 1000:>9.3f} {s['p95'] * 1000:>9.3f} {s['max'] * 1000:>9.3f}")
+        return "\n".join(lines)
+
+    def dump(self):
+        """集計結果をログに出力する"""
+        if not self.enabled:
+            logger.info("処理時間の計測は無効です（DATAMATRIX_TIMING=1 または --timing で有効）")
+            return
+        logger.info("処理時間の集計 (ms):\n%s", self.report())
+
+
+# プロセス全体で共有する計測
+timings = Timings()
+
+
+def span(name):
+    """timings.spanの短縮形"""
+    return timings.span(name)
+
+
+def configure(level=None, timing=None):
+    """
+    ログと計測を設定する
+    省略した値は環境変数 DATAMATRIX_LOG_LEVEL / DATAMATRIX_TIMING から決める
+    計測を有効にした場合は終了時に集計結果を出力する
+    """
+    level = level or os.environ.get("DATAMATRIX_LOG_LEVEL", "INFO")
+    logging.basicConfig(level=level.upper(), format=LOG_FORMAT)
+
+    if timing is None:
+        timing = os.environ.get("DATAMATRIX_TIMING", "") not in ("", "0")
+    if timing and not timings.enabled:
+        timings.enabled = True
+        atexit.register(timings.dump)
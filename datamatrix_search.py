@@ -0,0 +1,159 @@
+"""
+コード一覧の検索インデックス
+dataとnameを対象に、前方一致・部分一致・あいまい一致（部分列）で検索する
+"""
+import bisect
+import re
+from itertools import accumulate
+
+from datamatrix_instrumentation import span
+
+# 検索モード（autoは前方一致、部分一致、あいまい一致の順に結果を並べる）
+SEARCH_MODES = ("auto", "prefix", "substring", "fuzzy")
+
+# 照合用テキストの区切り（1コード1行で、dataとnameはタブで区切る）
+ROW_END = "\n"
+KEY_SEP = "\t"
+
+
+def normalize(text):
+    """検索用に文字列を正規化（大文字小文字を区別しない。区切り文字は空白にする）"""
+    return text.casefold().replace(ROW_END, " ").replace(KEY_SEP, " ")
+
+
+class CodeIndex:
+    """
+    コードのインメモリ検索インデックス
+    - 前方一致: ソート済みのキー一覧を二分探索
+    - 部分一致: コードごとの照合用テキスト（dataとname）のリストを走査
+    - あいまい一致: 照合用テキストを連結したものを正規表現でまとめて走査
+    追加は末尾に足し、削除は削除済みとして印を付けるだけなので、
+    インデックス全体を作り直さずに反映される（削除済みが増えたら詰め直す）
+    結果は一覧に追加した順（あいまい一致は一致範囲が短い順）で返す
+    """
+
+    # 削除済みの行がこの件数と有効な件数を超えたら詰め直す
+    COMPACT_MIN = 1024
+
+    def __init__(self, codes=()):
+        """コード一覧からインデックスを作成する"""
+        self._seq = 0
+        with span("search_index_build"):
+            self._rebuild([(self._next_seq(), code) for code in codes])
+
+    def __len__(self):
+        return len(self._codes)
+
+    @staticmethod
+    def keys_of(code):
+        """コードの検索対象の文字列（正規化済み）"""
+        if code.name:
+            return [normalize(code.data), normalize(code.name)]
+        return [normalize(code.data)]
+
+    def _next_seq(self):
+        seq = self._seq
+        self._seq += 1
+        return seq
+
+    def _rebuild(self, entries):
+        """(連番, コード) のリストから全ての構造を作り直す"""
+        self._codes = dict(entries)                                   # 連番 -> コード（追加順）
+        self._seq_of = {id(code): seq for seq, code in entries}       # id(コード) -> 連番
+        self._removed = set()
+        self._row_seqs = [seq for seq, _ in entries]                  # 行ごとの連番
+        keys = [self.keys_of(code) for _, code in entries]
+        self._rows = [KEY_SEP.join(row) for row in keys]              # 行ごとの照合用テキスト
+        self._sorted = sorted((key, seq) for seq, row in zip(self._row_seqs, keys) for key in row)
+        self._haystack = None
+
+    def _text(self):
+        """あいまい一致用の連結テキストと各行の開始位置（変更後に初めて使うときに作成）"""
+        if self._haystack is None:
+            starts = [0]
+            starts.extend(accumulate(len(row) + 1 for row in self._rows))
+            self._haystack = (ROW_END.join(self._rows), starts)
+        return self._haystack
+
+    def add(self, code):
+        """コードをインデックスに追加"""
+        seq = self._next_seq()
+        keys = self.keys_of(code)
+        self._codes[seq] = code
+        self._seq_of[id(code)] = seq
+        for key in keys:
+            bisect.insort(self._sorted, (key, seq))
+        self._row_seqs.append(seq)
+        self._rows.append(KEY_SEP.join(keys))
+        self._haystack = None
+
+    def remove(self, code):
+        """コードをインデックスから削除"""
+        seq = self._seq_of.pop(id(code), None)
+        if seq is None:
+            return
+        del self._codes[seq]
+        for key in self.keys_of(code):
+            pos = bisect.bisect_left(self._sorted, (key, seq))
+            if pos < len(self._sorted) and self._sorted[pos] == (key, seq):
+                del self._sorted[pos]
+        self._removed.add(seq)
+
+        if len(self._removed) > max(self.COMPACT_MIN, len(self._codes)):
+            with span("search_index_compact"):
+                self._rebuild(list(self._codes.items()))
+
+    def search(self, query, mode="auto"):
+        """queryに一致するコードのリストを返す（空のqueryは全件）"""
+        query = normalize(query.strip())
+        if not query:
+            return list(self._codes.values())
+
+        with span(f"search_{mode}"):
+            if mode == "auto":
+                # 前方一致、部分一致、あいまい一致の順に重複を除いて並べる
+                seen = set()
+                seqs = []
+                for matcher in (self._prefix, self._substring, self._fuzzy):
+                    for seq in matcher(query):
+                        if seq not in seen:
+                            seen.add(seq)
+                            seqs.append(seq)
+            else:
+                seqs = {"prefix": self._prefix, "substring": self._substring,
+                        "fuzzy": self._fuzzy}[mode](query)
+            return [self._codes[seq] for seq in seqs]
+
+    def _prefix(self, query):
+        """前方一致する連番（追加順）"""
+        found = set()
+        pos = bisect.bisect_left(self._sorted, (query, -1))
+        while pos < len(self._sorted) and self._sorted[pos][0].startswith(query):
+            found.add(self._sorted[pos][1])
+            pos += 1
+        return sorted(found)
+
+    def _substring(self, query):
+        """部分一致する連番（追加順）"""
+        removed = self._removed
+        return [seq for seq, row in zip(self._row_seqs, self._rows)
+                if query in row and seq not in removed]
+
+    def _fuzzy(self, query):
+        """queryの文字を順番どおりに1つのキー内に含む（部分列として一致する）連番（一致範囲が短い順）"""
+        # 文字の間は次の文字を含まない繰り返しにして、各文字を直後の最初の出現に一致させる
+        # （最短一致の繰り返しだと、繰り返しの多いデータで一致しないときにバックトラックが指数的に増える）
+        # 一致の開始はquery[0]が続く箇所の先頭だけにする（ゼロ埋めの連番で開始位置ごとに走査し直さない）
+        seps = re.escape(KEY_SEP + ROW_END)
+        first = re.escape(query[0])
+        pattern = re.compile(f"{first}(?<!{first}{first})" + "".join(
+            f"[^{re.escape(char)}{seps}]*{re.escape(char)}" for char in query[1:]))
+        text, starts = self._text()
+        row_seqs, removed = self._row_seqs, self._removed
+        spans = {}
+        for match in pattern.finditer(text):
+            seq = row_seqs[bisect.bisect_right(starts, match.start()) - 1]
+            if seq not in removed:
+                length = match.end() - match.start()
+                spans[seq] = min(length, spans.get(seq, length))
+        return sorted(spans, key=lambda seq: (spans[seq], seq))
@@ -0,0 +1,146 @@
+"""
+保存済みのシンボル画像の検証
+画像ストアの画像をpylibdmtxで読み取り、コードのdataと一致するかを確かめる
+（インデックスファイルを手で編集して、画像とdataが食い違ったものを見つける）
+
+最後に検証に成功した画像は検証記録（画像のハッシュ -> 読み取ったデータ）に残し、
+画像もdataも変わっていないコードは次回から読み取りを省略する
+画像ストアは全てのコードセットで共有なので、検証記録も共有する
+"""
+import hashlib
+import json
+import os
+from io import BytesIO
+
+from datamatrix_core import DEFAULT_SYMBOLOGY, atomic_write, bulk_encode
+from datamatrix_encoders import BACKENDS
+from datamatrix_instrumentation import span
+
+# 検証結果の状態
+VERIFIED = "verified"        # 読み取った内容がdataと一致した
+UNCHANGED = "unchanged"      # 前回の検証から画像もdataも変わっていない（読み取りを省略）
+SKIPPED = "skipped"          # 画像を保存していない（ペイロードのみ）か、読み取りに対応していないシンボル体系
+MISMATCH = "mismatch"        # 読み取った内容がdataと異なる
+UNREADABLE = "unreadable"    # シンボルを読み取れなかった
+MISSING = "missing"          # 画像ファイルがない
+CORRUPT = "corrupt"          # 画像ファイルの内容がハッシュと一致しない
+ERROR = "error"              # 読み取り中のエラー
+
+# 問題として報告する状態
+FAILURES = (MISMATCH, UNREADABLE, MISSING, CORRUPT, ERROR)
+
+# 状態の表示名
+STATUS_LABELS = {
+    VERIFIED: "一致",
+    UNCHANGED: "前回から変更なし",
+    SKIPPED: "対象外",
+    MISMATCH: "不一致",
+    UNREADABLE: "読み取り不可",
+    MISSING: "画像なし",
+    CORRUPT: "画像の破損",
+    ERROR: "エラー",
+}
+
+# 1画像の読み取りにかける時間の上限（ミリ秒、読み取れない画像で止まらないように）
+DECODE_TIMEOUT_MS = 2000
+
+
+def decoder_available():
+    """Data Matrixの読み取り（pylibdmtx.decode）を使えるか"""
+    return BACKENDS["pylibdmtx"].load() is not None
+
+
+def decode_png(png):
+    """Data MatrixのPNGを読み取り、データ（文字列）を返す（読み取れなければNone）"""
+    from PIL import Image
+
+    pylibdmtx = BACKENDS["pylibdmtx"].load()
+    if pylibdmtx is None:
+        raise ImportError("pylibdmtxがインストールされていません")
+    with span("decode_symbol"):
+        results = pylibdmtx.decode(Image.open(BytesIO(png)), timeout=DECODE_TIMEOUT_MS, max_count=1)
+    if not results:
+        return None
+    return results[0].data.decode("utf8")
+
+
+def verify_image(task):
+    """
+    プロセスプール用: 画像ファイルを読み取ってdataと比較し、(状態, 読み取った内容またはエラー) を返す
+    taskは (画像ファイルのパス, 画像のハッシュ, data)
+    """
+    path, image_hash, data = task
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+    except OSError as e:
+        return MISSING, str(e)
+
+    if hashlib.sha256(png).hexdigest() != image_hash:
+        return CORRUPT, None
+
+    try:
+        decoded = decode_png(png)
+    except Exception as e:
+        return ERROR, str(e)
+    if decoded is None:
+        return UNREADABLE, None
+    return (VERIFIED if decoded == data else MISMATCH), decoded
+
+
+class VerificationLedger:
+    """最後に検証に成功した画像の記録（画像のハッシュ -> そのとき一致したdata）"""
+
+    def __init__(self, path):
+        """記録ファイルのパスを指定して初期化する"""
+        self.path = path
+        self.verified = {}
+
+    def load(self):
+        """記録ファイルを読み込む（なければ空の記録）"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.verified = json.load(f).get("verified", {})
+
+    def save(self):
+        """記録ファイルをアトミックに書き込む（失敗時は例外を送出）"""
+        data = {"version": 1, "verified": self.verified}
+        atomic_write(self.path, json.dumps(data, ensure_ascii=False).encode("utf8"))
+
+    def is_current(self, code):
+        """前回の検証から画像もdataも変わっていないか"""
+        return code.digest is not None and self.verified.get(code.image_hash) == code.data
+
+    def record(self, code):
+        """codeの検証に成功したことを記録"""
+        self.verified[code.image_hash] = code.data
+
+    def discard(self, code):
+        """codeの画像の記録を消す（一致しなくなった画像を次回も読み取るように）"""
+        self.verified.pop(code.image_hash, None)
+
+
+def verify_codes(store, codes, ledger, jobs=None):
+    """
+    codesの画像を検証し、(コード, 状態, 読み取った内容またはエラー) を返すジェネレータ
+    読み取りを省略するコードを先に返し、残りはプロセスプールで読み取った順（入力順）に返す
+    結果はledgerに反映する（保存は呼び出し側で行う）
+    """
+    pending = []
+    for code in codes:
+        if code.digest is None or code.symbology != DEFAULT_SYMBOLOGY:
+            yield code, SKIPPED, None
+        elif ledger.is_current(code):
+            yield code, UNCHANGED, None
+        else:
+            pending.append(code)
+
+    tasks = [(store.image_store.path_for(code.image_hash), code.image_hash, code.data)
+             for code in pending]
+    for code, (status, detail) in zip(pending, bulk_encode(tasks, jobs=jobs, worker=verify_image)):
+        if status == VERIFIED:
+            ledger.record(code)
+        else:
+            ledger.discard(code)
+        yield code, status, detail
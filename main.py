@@ -1,29 +1,153 @@
-import tkinter as tk
-from tkinter import simpledialog, messagebox, ttk, StringVar, BooleanVar
-from PIL import Image, ImageTk
-import io
+import time
+# 起動時間の計測用（他のモジュールをインポートする前に記録）
+_START_TIME = time.perf_counter()
+
+import argparse
 import json
-import os
-import base64
+import logging
+import queue
+import sys
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from io import BytesIO
-import getpass
 
-# Data Matrixサポートの確認
+# GUIはtkinterがある環境でのみ使用（renderコマンドはtkinterなしで動作する）
+# PILは最初のコードを表示するときにインポートする
 try:
-    from pylibdmtx import pylibdmtx
-    DATAMATRIX_AVAILABLE = True
+    import tkinter as tk
+    from tkinter import simpledialog, messagebox, filedialog, ttk, StringVar, BooleanVar
+    GUI_AVAILABLE = True
 except ImportError:
-    DATAMATRIX_AVAILABLE = False
-    
+    GUI_AVAILABLE = False
+
+from datamatrix_instrumentation import configure as configure_instrumentation, span, timings
+from datamatrix_core import (
+    DEFAULT_SYMBOLOGY,
+    SYMBOLOGIES,
+    CodeSets,
+    CodeStore,
+    bulk_encode,
+    datamatrix_available,
+    detect_import_format,
+    encode_payload,
+    encoder_name,
+    generate_datamatrix,
+    get_config_path,
+    iter_payloads,
+    read_payloads,
+    symbology_available,
+)
+from datamatrix_search import CodeIndex
+from datamatrix_verify import (
+    FAILURES,
+    MISMATCH,
+    STATUS_LABELS,
+    VerificationLedger,
+    decoder_available,
+    verify_codes,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoImageCache:
+    """
+    表示用PhotoImageのLRUキャッシュ
+    キーは (コードの識別子, 画像内容のハッシュ, 拡大率) で、内容が変わったコードや
+    拡大率ごとに別エントリになる
+    """
+
+    def __init__(self, max_size=64):
+        """最大保持数を指定してキャッシュを初期化する"""
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        # 統計情報（ナビゲーションがウォームアップ後にO(1)か確認するため）
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def get(self, key, factory):
+        """キーに対応する画像を返す。なければfactoryで作成して登録する"""
+        photo = self._entries.get(key)
+        if photo is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return photo
+        self.misses += 1
+        return self._put(key, factory())
+
+    def prefetch(self, key, factory):
+        """統計に影響を与えずに画像を先読みする"""
+        if key in self._entries:
+            return
+        self.prefetched += 1
+        self._put(key, factory())
+
+    def _put(self, key, photo):
+        """エントリを追加し、上限を超えた古いエントリを破棄する"""
+        self._entries[key] = photo
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return photo
+
+    def discard_code(self, code_id):
+        """指定したコードに関するエントリを全て破棄する"""
+        for key in [k for k in self._entries if k[0] == code_id]:
+            del self._entries[key]
+
+    def clear(self):
+        """全エントリを破棄する"""
+        self._entries.clear()
+
+    def stats(self):
+        """ヒット/ミスの統計を返す"""
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefetched": self.prefetched,
+        }
+
+
 class DataMatrixTool:
     """
     Data Matrixコード表示ツール
     機能:
     - 複数のData Matrixコードを登録・保存
     - タイトルバーを除くUIを表示/非表示に切り替え
-    - ユーザーごとの設定ファイルに保存
+    - ユーザーごとの設定ファイルに保存（保存形式と設定はCodeStoreを参照）
+    - 生産ラインごとなどの名前付きコードセットを切り替え（セットごとに保存し、開くときにロード）
+    - コードごとにData MatrixかQRコードを選択（シンボル体系は各コードに保存する）
+    - 同時に起動した他のウィンドウでの追加・削除をジャーナルから取り込んで反映
     """
     
+    # 表示用画像キャッシュの最大数
+    PHOTO_CACHE_SIZE = 64
+    # 現在のコードの前後何件を先読みするか
+    PREFETCH_RADIUS = 2
+    # コード選択ボタンの表示行数（これを超える場合はスクロール表示）
+    BUTTON_ROWS = 6
+    # 一括インポートで画面に反映する件数と、進捗を確認する間隔（ミリ秒）
+    IMPORT_BATCH_SIZE = 200
+    IMPORT_POLL_MS = 100
+    # コードの追加やプリセットの生成の結果を確認する間隔（ミリ秒）
+    ENCODE_POLL_MS = 20
+    # 連続した変更をまとめて保存するまでの待ち時間（ミリ秒）
+    SAVE_DELAY_MS = 500
+    # 他のインスタンスの変更をジャーナルから取り込む間隔（ミリ秒）
+    SYNC_INTERVAL_MS = 500
+    # 検索欄の入力が止まってから絞り込むまでの待ち時間（ミリ秒）
+    SEARCH_DELAY_MS = 150
+    # 拡大率の選択肢（0は表示エリアに収まる最大の整数倍）
+    ZOOM_LEVELS = (0, 1, 2, 3, 4, 6, 8)
+    # ウィンドウのリサイズや拡大率の変更が止まってから描き直すまでの待ち時間（ミリ秒）
+    RESCALE_DELAY_MS = 150
+    # 表示エリアのうちコード情報の文字に使う高さ（ピクセル）
+    CAPTION_HEIGHT = 36
+    
     def __init__(self, root):
         """アプリケーションをルートウィンドウで初期化する"""
         # メインアプリケーションウィンドウ
@@ -34,9 +158,65 @@ class DataMatrixTool:
         # 標準ウィンドウ装飾を使用
         self.root.overrideredirect(False)
         
-        # Data Matrixコードの保存
-        self.datamatrix_codes = []
-        self.current_index = 0
+        # Data Matrixコードの保存（インデックスと画像ストア）
+        # storeは開いているコードセットのもので、セットの一覧はロード時に読み込む
+        self.code_sets = CodeSets(self.get_config_path())
+        self.store = CodeStore(self.get_config_path())
+        
+        # 表示用画像のキャッシュ（前後のコードも先読みする）
+        self.photo_cache = PhotoImageCache(max_size=self.PHOTO_CACHE_SIZE)
+        self._prefetch_job = None
+        
+        # 拡大表示（zoomが0なら表示エリアに合わせる）。シンボルの元の大きさは内容ごとに記録する
+        self.zoom = 0
+        self.display_size = (0, 0)
+        self.symbol_sizes = {}
+        self._rescale_job = None
+        
+        # 新しく追加・インポートするコードのシンボル体系（登録フォームで選択する）
+        self.symbology = DEFAULT_SYMBOLOGY
+        
+        # 一括インポートの状態（ワーカースレッドからキュー経由で結果を受け取る）
+        self.import_thread = None
+        self.import_queue = queue.Queue()
+        self.import_total = 0
+        self.import_done = 0
+        self.import_errors = []
+        
+        # 画像の検証の状態（インポートと同様にワーカースレッドからキュー経由で進捗を受け取る）
+        self.verify_thread = None
+        self.verify_queue = queue.Queue()
+        self.verify_total = 0
+        self.verify_done = 0
+        self.verify_failures = []
+        
+        # 印刷用シートの書き出しの状態（ページを書き出すごとにキュー経由で進捗を受け取る）
+        self.export_thread = None
+        self.export_queue = queue.Queue()
+        self.export_pages = 0
+        
+        # 符号化と保存（ジャーナルの追記と読み込みも）はTkのイベントループを止めないようワーカースレッドで行う
+        self.encode_executor = ThreadPoolExecutor(max_workers=1)
+        self.save_executor = ThreadPoolExecutor(max_workers=1)
+        # 符号化の結果は (Tkスレッドで呼ぶ関数, Future) としてキュー経由で受け取る
+        # （ワーカースレッドからTkを呼ぶと、終了時にexecutorの終了を待つTkスレッドと互いに待ち合う）
+        self.encode_queue = queue.Queue()
+        self.encode_pending = 0
+        self._encode_poll_job = None
+        self._save_job = None
+        self._sync_job = None
+        # 他のインスタンスの変更の読み込み中なら (読み込み元のstore, Future)
+        self._sync_read = None
+        # コードセットの切り替え・作成のファイル操作中なら (Future, 完了時にTkスレッドで呼ぶ関数, 引数)
+        self._set_task = None
+        
+        # 検索インデックス（最初に検索欄を使うときに作成し、以降は追加・削除を反映する）
+        # filtered_codesは絞り込み中の一致したコード、filter_positionはその中での現在のコードの位置
+        self.search_index = None
+        self.search_query = ""
+        self.filtered_codes = None
+        self.filter_position = None
+        self._search_job = None
         
         # UI表示フラグ
         self.ui_visible = True
@@ -45,20 +225,89 @@ class DataMatrixTool:
         self.always_on_top = BooleanVar(value=True)
         self.root.attributes("-topmost", self.always_on_top.get())
         
-        # 保存されたData Matrixコードをロード
-        self.load_codes()
+        # 起動時間の計測値（秒、プロセス開始からの経過時間）
+        self.startup_metrics = {}
+        self.presets_pending = False
+        self.started = False
+        self._startup_callbacks = []
         
         # UIを作成
         self.create_ui()
+        self.code_display.config(text="読み込み中...")
+        self.root.bind("<Expose>", self.on_first_paint, add="+")
+        
+        # ウィンドウを表示してから、コードのロードなど時間のかかる処理を行う
+        self.root.after_idle(lambda: self.root.after(0, self.finish_startup))
+    
+    def on_first_paint(self, event):
+        """最初にウィンドウが描画されたときの時間を記録"""
+        if "first_paint" not in self.startup_metrics:
+            self.record_startup_metric("first_paint")
+    
+    def record_startup_metric(self, name):
+        """起動からの経過時間を記録してログに出力"""
+        elapsed = time.perf_counter() - _START_TIME
+        self.startup_metrics[name] = elapsed
+        timings.record(f"startup_{name}", elapsed)
+        logger.info("起動時間 %s: %.1f ms", name, elapsed * 1000)
+    
+    def finish_startup(self):
+        """ウィンドウの表示後にコードをロードし、現在のコードだけを表示する"""
+        # 保存されたData Matrixコードをロード
+        self.load_codes()
         
-        # 初期表示
+        # 他のインスタンスの変更の取り込みを開始
+        self._sync_job = self.root.after(self.SYNC_INTERVAL_MS, self.sync_store)
+        
+        # 初期表示（前後のコードは表示後のアイドル時に先読みされる）
         self.update_display()
+        if self.datamatrix_codes:
+            self.record_startup_metric("first_code")
         
         # デバッグ情報を表示
-        print(f"ロードされたコード数: {len(self.datamatrix_codes)}")
+        logger.debug("ロードされたコード数: %d", len(self.datamatrix_codes))
         if self.datamatrix_codes:
-            print(f"現在のインデックス: {self.current_index}")
-            print(f"最初のコードデータ: {self.datamatrix_codes[0]['data'][:20]}...")
+            logger.debug("現在のインデックス: %d", self.current_index)
+            logger.debug("最初のコードデータ: %s...", self.datamatrix_codes[0].data[:20])
+        
+        # エンコーダーはバックグラウンドで読み込んでおく（最初の追加を待たせない）
+        self.encode_executor.submit(self.check_encoder)
+        
+        self.started = True
+        callbacks, self._startup_callbacks = self._startup_callbacks, []
+        for callback in callbacks:
+            callback()
+    
+    def check_encoder(self):
+        """ワーカースレッド: エンコーダーを読み込んで選択し、利用できなければ警告する"""
+        if not datamatrix_available():
+            logger.warning("Data Matrixエンコーダーがありません。"
+                           "コードを生成するには次のコマンドを実行してください: pip install pylibdmtx（またはnumpy）")
+    
+    def after_startup(self, callback):
+        """起動処理（コードのロード）が終わってからcallbackを実行する"""
+        if self.started:
+            callback()
+        else:
+            self._startup_callbacks.append(callback)
+    
+    @property
+    def datamatrix_codes(self):
+        """コード一覧（CodeStoreが保持）"""
+        return self.store.codes
+    
+    @datamatrix_codes.setter
+    def datamatrix_codes(self, codes):
+        self.store.codes = codes
+    
+    @property
+    def current_index(self):
+        """表示中のコードのインデックス（CodeStoreと一緒に保存される）"""
+        return self.store.current_index
+    
+    @current_index.setter
+    def current_index(self, index):
+        self.store.current_index = index
     
     def create_ui(self):
         """全てのUI要素を作成"""
@@ -80,6 +329,13 @@ class DataMatrixTool:
                                         font=("Arial", 8), bd=0, padx=5, command=self.toggle_ui)
         self.ui_toggle_button.pack(side=tk.RIGHT, padx=2)
         
+        # コードセットの選択（ロード後にメニューを作成）
+        self.set_var = StringVar()
+        self.set_menu = tk.OptionMenu(self.title_bar, self.set_var, "")
+        self.set_menu.config(bg="#2c3e50", fg="white", activebackground="#3498db",
+                             font=("Arial", 8), bd=0, highlightthickness=0)
+        self.set_menu.pack(side=tk.RIGHT, padx=2)
+        
         # コンテンツフレーム（タイトルバー以外の全UI要素を含む）
         self.content_frame = tk.Frame(self.main_frame, bg="#f0f0f1")
         self.content_frame.pack(fill=tk.BOTH, expand=True)
@@ -91,10 +347,18 @@ class DataMatrixTool:
         # Data Matrix表示エリア
         self.display_frame = tk.Frame(self.center_frame, bg="#ffffff", bd=1, relief=tk.SUNKEN)
         self.display_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 5), pady=5)
+        # 拡大したシンボルが表示エリアより大きくても、ウィンドウのレイアウトを押し広げずに中央を表示する
+        # （固定の拡大率で選択ボタンやコントロールバーが押し出されて元に戻せなくならないように）
+        self.display_frame.pack_propagate(False)
         
         self.code_display = tk.Label(self.display_frame, bg="#ffffff")
         self.code_display.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
+        # 表示エリアの大きさが変わったら（連続したイベントはまとめて）拡大率を計算し直す
+        self.display_frame.bind("<Configure>", lambda event: self.schedule_rescale())
+        self.code_display.bind("<Control-MouseWheel>",
+                               lambda event: self.step_zoom(1 if event.delta > 0 else -1))
+        
         # コード選択ボタンエリア - 明示的に幅と高さを設定
         self.buttons_frame = tk.Frame(self.center_frame, bg="#ecf0f1", bd=1, relief=tk.SUNKEN, width=100, height=200)
         self.buttons_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(5, 0), pady=5)
@@ -102,9 +366,30 @@ class DataMatrixTool:
         # ボタンフレームを固定サイズに
         self.buttons_frame.pack_propagate(False)
         
-        # コントロールバー
+        # 検索欄（dataとnameで一覧を絞り込む。Enterで最初の候補を選択、Escで解除）
+        self.search_var = StringVar()
+        self.search_entry = tk.Entry(self.buttons_frame, textvariable=self.search_var, width=12)
+        self.search_entry.grid(row=0, column=0, columnspan=2, padx=2, pady=2, sticky="ew")
+        self.search_var.trace_add("write", lambda *args: self.schedule_search())
+        self.search_entry.bind("<FocusIn>", lambda event: self.ensure_search_index())
+        self.search_entry.bind("<Return>", lambda event: self.select_code(0))
+        self.search_entry.bind("<Escape>", lambda event: self.search_var.set(""))
+        
+        # ボタンは表示範囲の分だけプールして再利用する
+        self.code_buttons = []
+        self.button_states = []
+        self.button_offset = 0
+        
+        # 6行に収まらないときのスクロールバー（必要なときだけ表示）
+        self.buttons_scrollbar = tk.Scrollbar(self.buttons_frame, orient=tk.VERTICAL,
+                                              width=10, command=self.on_buttons_scroll)
+        self.buttons_scrollbar.grid(row=1, column=1, rowspan=self.BUTTON_ROWS, sticky="ns")
+        self.buttons_scrollbar.grid_remove()
+        self.bind_button_wheel(self.buttons_frame)
+        
+        # コントロールバー（中央フレームより先に配置して、常に高さを確保する）
         self.control_frame = tk.Frame(self.content_frame, bg="#ecf0f1", height=30)
-        self.control_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=10, pady=5)
+        self.control_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=10, pady=5, before=self.center_frame)
         
         # Data Matrix追加ボタン
         self.add_button = tk.Button(self.control_frame, text="追加", bg="#2ecc71", fg="white",
@@ -125,6 +410,29 @@ class DataMatrixTool:
                                    font=("Arial", 8), bd=0, padx=5, command=self.next_code)
         self.next_button.pack(side=tk.LEFT, padx=2, pady=2)
         
+        # 一括インポートボタン
+        self.import_button = tk.Button(self.control_frame, text="取込", bg="#e67e22", fg="white",
+                                     font=("Arial", 8), bd=0, padx=5, command=self.import_file)
+        self.import_button.pack(side=tk.LEFT, padx=2, pady=2)
+        
+        # 保存済み画像の検証ボタン
+        self.verify_button = tk.Button(self.control_frame, text="検証", bg="#16a085", fg="white",
+                                     font=("Arial", 8), bd=0, padx=5, command=self.start_verification)
+        self.verify_button.pack(side=tk.LEFT, padx=2, pady=2)
+        
+        # 印刷用シートの書き出しボタン
+        self.export_button = tk.Button(self.control_frame, text="印刷", bg="#34495e", fg="white",
+                                     font=("Arial", 8), bd=0, padx=5, command=self.start_export)
+        self.export_button.pack(side=tk.LEFT, padx=2, pady=2)
+        
+        # 拡大率の選択（自動は表示エリアに収まる最大の整数倍）
+        self.zoom_var = StringVar(value=self.zoom_label(self.zoom))
+        self.zoom_menu = tk.OptionMenu(self.control_frame, self.zoom_var,
+                                       *[self.zoom_label(level) for level in self.ZOOM_LEVELS],
+                                       command=self.on_zoom_selected)
+        self.zoom_menu.config(bg="#ecf0f1", font=("Arial", 8), bd=0, highlightthickness=0)
+        self.zoom_menu.pack(side=tk.LEFT, padx=2, pady=2)
+        
         # 常に最前面に表示するチェックボックス
         self.topmost_check = tk.Checkbutton(self.control_frame, text="最前面", 
                                           variable=self.always_on_top, bg="#ecf0f1",
@@ -134,63 +442,209 @@ class DataMatrixTool:
         # 登録フォーム（デフォルトでは非表示）
         self.form_frame = tk.Frame(self.content_frame, bg="#ecf0f1", padx=10, pady=10)
         
-        # キーボードバインディングを追加
-        self.root.bind("<Left>", lambda event: self.prev_code())
-        self.root.bind("<Right>", lambda event: self.next_code())
+        # キーボードバインディングを追加（検索欄の入力中はカーソル移動に使う）
+        self.root.bind("<Left>", lambda event: self.on_arrow_key(event, self.prev_code))
+        self.root.bind("<Right>", lambda event: self.on_arrow_key(event, self.next_code))
+        self.root.bind("<plus>", lambda event: self.on_arrow_key(event, lambda: self.step_zoom(1)))
+        self.root.bind("<minus>", lambda event: self.on_arrow_key(event, lambda: self.step_zoom(-1)))
+        
+        # 処理時間の集計をログに出力するホットキー
+        self.root.bind("<F12>", lambda event: timings.dump())
+    
+    def on_arrow_key(self, event, command):
+        """キー操作でコードや拡大率を切り替える（検索欄にフォーカスがあるときは何もしない）"""
+        if not isinstance(event.widget, tk.Entry):
+            command()
+    
+    def visible_codes(self):
+        """ボタン一覧に並べるコード（絞り込み中は一致したコードのみ）"""
+        return self.datamatrix_codes if self.filtered_codes is None else self.filtered_codes
+    
+    def visible_position(self):
+        """現在のコードのボタン一覧での位置（絞り込み結果に含まれなければNone）"""
+        return self.current_index if self.filtered_codes is None else self.filter_position
     
     def update_buttons(self):
-        """コード選択ボタンを更新する"""
+        """コード選択ボタンを更新する（選択中のコードが見える位置までスクロール）"""
         # デバッグ情報表示
-        print(f"update_buttons が呼ばれました。コード数: {len(self.datamatrix_codes)}")
+        logger.debug("update_buttons が呼ばれました。コード数: %d", len(self.datamatrix_codes))
         
-        # 既存のボタンを削除
-        for widget in self.buttons_frame.winfo_children():
-            widget.destroy()
-            
-        if not self.datamatrix_codes:
-            # コードがない場合は何も表示しない
-            print("コードがないため、ボタンは作成されません")
-            return
-            
-        # ボタンを作成
-        for i, code in enumerate(self.datamatrix_codes):
-            # データの短縮表示用
-            data = code["data"]
-            if len(data) > 10:
-                data = data[:7] + "..."
-                
-            # 行と列の計算（6行で次の列に移動）
-            row = i % 6
-            col = i // 6
+        # 選択中のコードが表示範囲に入るようにオフセットを調整
+        position = self.visible_position()
+        if position is not None:
+            if position < self.button_offset:
+                self.button_offset = position
+            elif position >= self.button_offset + self.BUTTON_ROWS:
+                self.button_offset = position - self.BUTTON_ROWS + 1
+        
+        self.render_buttons()
+    
+    def render_buttons(self):
+        """
+        ボタンプールを表示するコード（絞り込み中は一致したコード）と差分比較して更新する
+        表示範囲（最大BUTTON_ROWS個）のボタンだけを保持し、
+        内容が変わったセルだけを再設定する
+        """
+        with span("widget_rebuild"):
+            codes = self.visible_codes()
+            count = len(codes)
+            position = self.visible_position()
+        
+            # オフセットを有効範囲に収める
+            max_offset = max(0, count - self.BUTTON_ROWS)
+            self.button_offset = min(max(0, self.button_offset), max_offset)
+        
+            visible = min(self.BUTTON_ROWS, count)
+        
+            # 足りないセルだけボタンを作成
+            while len(self.code_buttons) < visible:
+                self.code_buttons.append(self.create_code_button(len(self.code_buttons)))
+                self.button_states.append(None)
+        
+            for cell, btn in enumerate(self.code_buttons):
+                if cell >= visible:
+                    # 使わないセルは非表示にして再利用に備える
+                    if self.button_states[cell] is not None:
+                        btn.grid_remove()
+                        self.button_states[cell] = None
+                    continue
             
-            # デバッグ情報表示
-            print(f"ボタン作成: インデックス={i}, データ={data}, 行={row}, 列={col}")
+                index = self.button_offset + cell
+                state = (self.button_label(codes[index]),
+                         "#3498db" if index == position else "#95a5a6")
+                if state == self.button_states[cell]:
+                    continue
             
-            # ボタンの作成
-            btn = tk.Button(
-                self.buttons_frame, 
-                text=data,
-                bg="#3498db" if i == self.current_index else "#95a5a6",
-                fg="white",
-                font=("Arial", 8),
-                bd=0,
-                padx=2,
-                pady=2,
-                width=10,
-                command=lambda idx=i: self.select_code(idx)
-            )
-            btn.grid(row=row, column=col, padx=2, pady=2, sticky="ew")
-        
-        # ボタン作成後にフレームを更新
-        self.buttons_frame.update()
-        print(f"ボタン更新完了。合計 {len(self.datamatrix_codes)} 個のボタンを作成")
+                if self.button_states[cell] is None:
+                    btn.grid()
+                btn.config(text=state[0], bg=state[1])
+                self.button_states[cell] = state
+        
+            # 6行に収まらない場合はスクロールバーを表示
+            if count > self.BUTTON_ROWS:
+                self.buttons_scrollbar.set(self.button_offset / count,
+                                           (self.button_offset + visible) / count)
+                self.buttons_scrollbar.grid()
+            else:
+                self.buttons_scrollbar.grid_remove()
+    
+    def create_code_button(self, cell):
+        """ボタンプールのセルを作成（セル番号とオフセットから選択するコードを決める）"""
+        btn = tk.Button(
+            self.buttons_frame,
+            fg="white",
+            font=("Arial", 8),
+            bd=0,
+            padx=2,
+            pady=2,
+            width=10,
+            command=lambda: self.select_code(self.button_offset + cell)
+        )
+        btn.grid(row=cell + 1, column=0, padx=2, pady=2, sticky="ew")
+        self.bind_button_wheel(btn)
+        return btn
+    
+    def button_label(self, code):
+        """ボタンに表示するデータの短縮表示"""
+        data = code.data
+        if len(data) > 10:
+            data = data[:7] + "..."
+        return data
+    
+    def bind_button_wheel(self, widget):
+        """ボタンエリアでマウスホイールによるスクロールを有効にする"""
+        widget.bind("<MouseWheel>", self.on_buttons_wheel)
+        widget.bind("<Button-4>", lambda event: self.scroll_buttons(-1))
+        widget.bind("<Button-5>", lambda event: self.scroll_buttons(1))
+    
+    def on_buttons_wheel(self, event):
+        """マウスホイールでボタン一覧をスクロール"""
+        self.scroll_buttons(-1 if event.delta > 0 else 1)
+    
+    def on_buttons_scroll(self, action, value, unit=None):
+        """スクロールバーの操作でボタン一覧をスクロール"""
+        if action == "moveto":
+            self.button_offset = int(round(float(value) * len(self.visible_codes())))
+            self.render_buttons()
+        elif action == "scroll":
+            step = self.BUTTON_ROWS if unit == "pages" else 1
+            self.scroll_buttons(int(value) * step)
+    
+    def scroll_buttons(self, delta):
+        """表示範囲を指定行数だけずらす（選択は変更しない）"""
+        self.button_offset += delta
+        self.render_buttons()
         
     def select_code(self, index):
-        """ボタンで選択されたコードを表示"""
-        if 0 <= index < len(self.datamatrix_codes):
+        """ボタンで選択されたコード（indexはボタン一覧での位置）を表示"""
+        codes = self.visible_codes()
+        if not 0 <= index < len(codes):
+            return
+        if self.filtered_codes is None:
             self.current_index = index
-            self.update_display()
-            
+        else:
+            self.current_index = self.index_of(codes[index])
+            self.filter_position = index
+        self.update_display()
+    
+    def index_of(self, code):
+        """コード一覧でのcodeの位置（同じ内容の別エントリと区別するため同一性で比較）"""
+        for index, candidate in enumerate(self.datamatrix_codes):
+            if candidate is code:
+                return index
+        return None
+    
+    def ensure_search_index(self):
+        """検索インデックスがなければ現在のコード一覧から作成する"""
+        if self.search_index is None:
+            self.search_index = CodeIndex(self.datamatrix_codes)
+        return self.search_index
+    
+    def schedule_search(self):
+        """入力が止まってから絞り込む（SEARCH_DELAY_MSの間の入力はまとめて1回の検索になる）"""
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(self.SEARCH_DELAY_MS, self.apply_search)
+    
+    def apply_search(self):
+        """検索欄の内容で絞り込み、ボタン一覧を先頭から表示し直す"""
+        self._search_job = None
+        self.search_query = self.search_var.get().strip()
+        self.refresh_filter()
+        self.button_offset = 0
+        self.update_buttons()
+    
+    def refresh_filter(self):
+        """現在の検索語で絞り込み結果と、その中での現在のコードの位置を更新する"""
+        if not self.search_query:
+            self.filtered_codes = None
+            self.filter_position = None
+            return
+        self.filtered_codes = self.ensure_search_index().search(self.search_query)
+        self.locate_current()
+    
+    def locate_current(self):
+        """絞り込み結果の中での現在のコードの位置を求め直す"""
+        self.filter_position = None
+        if self.filtered_codes is None or not self.datamatrix_codes:
+            return
+        current = self.datamatrix_codes[self.current_index]
+        for position, code in enumerate(self.filtered_codes):
+            if code is current:
+                self.filter_position = position
+                break
+    
+    def add_codes(self, codes):
+        """コード一覧の末尾に追加し（ジャーナルにも記録する）、検索インデックスと絞り込み結果にも反映する"""
+        record = self.store.append_codes(codes)
+        if record is not None:
+            self.write_record(record)
+        if self.search_index is not None:
+            for code in codes:
+                self.search_index.add(code)
+        if self.filtered_codes is not None:
+            self.refresh_filter()
+    
     def delete_current(self):
         """現在表示中のコードを削除"""
         if not self.datamatrix_codes:
@@ -202,18 +656,33 @@ class DataMatrixTool:
         if not confirm:
             return
             
-        # 現在のコードを削除
-        del self.datamatrix_codes[self.current_index]
+        # 現在のコードを削除し（ジャーナルにも記録する）、キャッシュと検索インデックスからも破棄
+        removed, record = self.store.delete_code(self.current_index)
+        self.write_record(record)
+        self.photo_cache.discard_code(id(removed))
+        if self.search_index is not None:
+            self.search_index.remove(removed)
         
         # インデックスを調整
         if not self.datamatrix_codes:
             self.current_index = 0
         elif self.current_index >= len(self.datamatrix_codes):
             self.current_index = len(self.datamatrix_codes) - 1
+        
+        # 絞り込み中は一致したコードの中で次のコードを選択
+        if self.filtered_codes is not None:
+            position = self.filter_position
+            self.filtered_codes = [code for code in self.filtered_codes if code is not removed]
+            if position is not None and self.filtered_codes:
+                position = min(position, len(self.filtered_codes) - 1)
+                self.current_index = self.index_of(self.filtered_codes[position])
+                self.filter_position = position
+            else:
+                self.locate_current()
             
         # 表示を更新
         self.update_display()
-        self.save_codes()  # 変更を保存
+        self.request_save()  # 変更を保存
         
     def toggle_ui(self):
         """タイトルバー以外のUIの表示/非表示を切り替え"""
@@ -254,16 +723,30 @@ class DataMatrixTool:
         data_entry.grid(row=0, column=1, pady=5)
         data_entry.focus()
         
-        # 保存ボタン
-        save_button = tk.Button(self.form_frame, text="保存", bg="#2ecc71", fg="white",
-                              command=lambda: self.add_code(data_entry.get()))
-        save_button.grid(row=2, column=0, pady=10)
+        # シンボル体系の選択（一括インポートにも使う）
+        tk.Label(self.form_frame, text="種類:", bg="#ecf0f1").grid(row=1, column=0, sticky="w", pady=5)
+        symbology_var = StringVar(value=SYMBOLOGIES[self.symbology])
+        symbology_menu = tk.OptionMenu(self.form_frame, symbology_var, *SYMBOLOGIES.values(),
+                                       command=self.on_symbology_selected)
+        symbology_menu.config(bg="#ecf0f1", bd=0, highlightthickness=0)
+        symbology_menu.grid(row=1, column=1, sticky="w", pady=5)
+        
+        # 保存ボタン（生成中は無効にする）
+        self.form_save_button = tk.Button(self.form_frame, text="保存", bg="#2ecc71", fg="white",
+                                        command=lambda: self.add_code(data_entry.get()))
+        self.form_save_button.grid(row=2, column=0, pady=10)
         
         # キャンセルボタン
         cancel_button = tk.Button(self.form_frame, text="キャンセル", bg="#e74c3c", fg="white",
                                 command=self.cancel_form)
         cancel_button.grid(row=2, column=1, pady=10)
     
+    def on_symbology_selected(self, label):
+        """登録フォームで選択されたシンボル体系を、以降に追加・インポートするコードに使う"""
+        for symbology, name in SYMBOLOGIES.items():
+            if name == label:
+                self.symbology = symbology
+    
     def cancel_form(self):
         """フォームをキャンセル"""
         self.form_frame.pack_forget()
@@ -275,82 +758,417 @@ class DataMatrixTool:
         self.display_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 5), pady=5)
         self.buttons_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(5, 0), pady=5)
         
-        # コントロールバーを再表示
-        self.control_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=10, pady=5)
+        # コントロールバーを再表示（中央フレームより先に配置して、常に高さを確保する）
+        self.control_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=10, pady=5, before=self.center_frame)
         
         # 表示を更新
         self.update_display()
     
     def add_code(self, data):
-        """新しいData Matrixコードを追加"""
+        """新しいコードを選択中のシンボル体系で追加"""
         if not data:
             messagebox.showerror("エラー", "データを入力してください")
             return
         
-        if not DATAMATRIX_AVAILABLE:
-            messagebox.showerror("エラー", "pylibdmtxがインストールされていません。\n"
-                               "'pip install pylibdmtx'を実行してください。")
+        if not symbology_available(self.symbology):
+            messagebox.showerror("エラー", missing_encoder_message(self.symbology))
             return
         
+        # コードの生成はワーカースレッドで今のセットに対して行い、結果はTkスレッドで反映する
+        # （完了するまでセットの切り替えはcan_switch_setで止める）
+        self.form_save_button.config(state=tk.DISABLED, text="生成中...")
+        self.submit_encode(self.on_code_built, self.store.build_code, data, None, self.symbology)
+    
+    def on_code_built(self, future):
+        """Tkスレッド: 生成したコードを一覧に追加して表示する"""
         try:
-            # Data Matrixコードを生成
-            img = self.generate_datamatrix(data)
-            
-            # 画像をBase64に変換
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            
-            # コードを保存
-            self.datamatrix_codes.append({
-                "data": data,
-                "image": img_str
-            })
-            
-            # 現在のインデックスを更新
-            self.current_index = len(self.datamatrix_codes) - 1
-            
-            # フォームを閉じる
-            self.cancel_form()
-            
-            # 表示を更新
-            self.update_display()
+            code = future.result()
+        except Exception as e:
+            self.form_save_button.config(state=tk.NORMAL, text="保存")
+            messagebox.showerror("エラー", f"{SYMBOLOGIES[self.symbology]}コードの生成に失敗しました: {str(e)}")
+            return
+        
+        # 一覧に追加して現在のインデックスを更新
+        self.add_codes([code])
+        self.current_index = len(self.datamatrix_codes) - 1
+        self.locate_current()
+        
+        # フォームを閉じる
+        self.cancel_form()
+        
+        # 表示を更新
+        self.update_display()
+        
+        # 保存
+        self.request_save()
+    
+    def submit_encode(self, callback, func, *args):
+        """funcをワーカースレッドで実行し、完了したらTkスレッドでcallback(future)を呼ぶ"""
+        future = self.encode_executor.submit(func, *args)
+        future.add_done_callback(lambda f: self.encode_queue.put((callback, f)))
+        self.encode_pending += 1
+        if self._encode_poll_job is None:
+            self._encode_poll_job = self.root.after(self.ENCODE_POLL_MS, self.poll_encode)
+    
+    def poll_encode(self):
+        """Tkスレッド: 完了した符号化の結果を反映する（実行中のものがなくなるまで確認を続ける）"""
+        self._encode_poll_job = None
+        try:
+            while True:
+                callback, future = self.encode_queue.get_nowait()
+                self.encode_pending -= 1
+                callback(future)
+        except queue.Empty:
+            pass
+        if self.encode_pending:
+            self._encode_poll_job = self.root.after(self.ENCODE_POLL_MS, self.poll_encode)
+    
+    def import_file(self):
+        """ファイルを選択してコードを一括インポート"""
+        path = filedialog.askopenfilename(
+            title="インポートするファイルを選択",
+            filetypes=[("CSV/TSV/テキスト", "*.csv *.tsv *.tab *.txt"), ("すべてのファイル", "*.*")]
+        )
+        if not path:
+            return
+        
+        try:
+            with open(path, "r", newline="", encoding="utf-8-sig") as f:
+                payloads = read_payloads(f, detect_import_format(path))
+        except Exception as e:
+            messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました: {str(e)}")
+            return
+        
+        self.bulk_import(payloads)
+    
+    def bulk_import(self, payloads):
+        """
+        (data, name) のリストを選択中のシンボル体系で一括インポート
+        符号化はワーカースレッドからプロセスプールで並列に行い、
+        結果はバッチごとにキュー経由でTkスレッドに反映する。保存は最後に一度だけ行う
+        """
+        if self.import_thread is not None:
+            messagebox.showinfo("情報", "インポート中です")
+            return
+        
+        if not symbology_available(self.symbology):
+            messagebox.showerror("エラー", missing_encoder_message(self.symbology))
+            return
+        
+        if not payloads:
+            messagebox.showinfo("情報", "インポートするデータがありません")
+            return
+        
+        self.import_total = len(payloads)
+        self.import_done = 0
+        self.import_errors = []
+        self.import_button.config(state=tk.DISABLED)
+        
+        self.import_thread = threading.Thread(target=self.run_bulk_import,
+                                              args=(payloads, self.symbology), daemon=True)
+        self.import_thread.start()
+        self.root.after(self.IMPORT_POLL_MS, self.poll_import)
+    
+    def run_bulk_import(self, payloads, symbology=DEFAULT_SYMBOLOGY):
+        """ワーカースレッド: 符号化結果を画像ストアに書き込み、バッチごとにキューへ送る"""
+        entries, errors, processed = [], [], 0
+        try:
+            results = bulk_encode([data for data, _ in payloads],
+                                  worker=partial(encode_payload, symbology=symbology))
+            for (data, png, error), (_, name) in zip(results, payloads):
+                processed += 1
+                if error is not None:
+                    errors.append((data, error))
+                else:
+                    entries.append(self.store.make_code(data, name, png, symbology))
+                
+                if processed >= self.IMPORT_BATCH_SIZE:
+                    self.import_queue.put(("batch", (entries, processed, errors)))
+                    entries, errors, processed = [], [], 0
             
-            # 保存
-            self.save_codes()
+            self.import_queue.put(("batch", (entries, processed, errors)))
+            self.import_queue.put(("done", None))
+        except Exception as e:
+            self.import_queue.put(("done", e))
+    
+    def poll_import(self):
+        """Tkスレッド: インポート結果をコード一覧に反映し、進捗を表示する"""
+        try:
+            while True:
+                kind, value = self.import_queue.get_nowait()
+                if kind == "done":
+                    self.finish_import(value)
+                    return
+                entries, processed, errors = value
+                self.add_codes(entries)
+                self.import_done += processed
+                self.import_errors.extend(errors)
+        except queue.Empty:
+            pass
+        
+        self.title_label.config(text=f"インポート中... {self.import_done}/{self.import_total}")
+        self.update_buttons()
+        self.root.after(self.IMPORT_POLL_MS, self.poll_import)
+    
+    def finish_import(self, error):
+        """インポート完了時に表示を更新し、一度だけ保存する"""
+        self.import_thread = None
+        self.import_button.config(state=tk.NORMAL)
+        self.title_label.config(text="Data Matrixコードツール")
+        
+        self.update_display()
+        self.request_save()
+        
+        added = self.import_done - len(self.import_errors)
+        if error is not None:
+            messagebox.showerror("エラー", f"インポート中にエラーが発生しました: {str(error)}\n"
+                               f"{added}個のコードを追加しました")
+        elif self.import_errors:
+            details = "\n".join(f"{data}: {message}" for data, message in self.import_errors[:5])
+            messagebox.showwarning("警告", f"{added}個のコードを追加しました。\n"
+                                 f"{len(self.import_errors)}個のデータは生成に失敗しました:\n{details}")
+        else:
+            messagebox.showinfo("情報", f"{added}個のコードを追加しました")
+    
+    def start_verification(self):
+        """
+        保存済みの画像を読み取り、dataと一致するかを検証する
+        読み取りはワーカースレッドからプロセスプールで並列に行い、進捗はキュー経由でTkスレッドに反映する
+        前回の検証から画像もdataも変わっていないコードは読み取らない
+        """
+        if self.verify_thread is not None:
+            messagebox.showinfo("情報", "検証中です")
+            return
+        
+        if self.import_thread is not None:
+            messagebox.showinfo("情報", "インポート中は検証できません")
+            return
+        
+        if not decoder_available():
+            messagebox.showerror("エラー", "検証にはpylibdmtxが必要です。\n"
+                               "'pip install pylibdmtx'を実行してください。")
+            return
+        
+        if not self.datamatrix_codes:
+            messagebox.showinfo("情報", "検証するコードがありません")
+            return
+        
+        # 検証中に一覧が変わっても影響されないよう、対象のコードは開始時点の一覧の複製にする
+        codes = list(self.datamatrix_codes)
+        self.verify_total = len(codes)
+        self.verify_done = 0
+        self.verify_failures = []
+        self.verify_button.config(state=tk.DISABLED)
+        
+        self.verify_thread = threading.Thread(target=self.run_verification,
+                                              args=(self.store, codes), daemon=True)
+        self.verify_thread.start()
+        self.root.after(self.IMPORT_POLL_MS, self.poll_verification)
+    
+    def run_verification(self, store, codes):
+        """ワーカースレッド: 画像を読み取って検証記録を更新し、進捗をバッチごとにキューへ送る"""
+        counts, failures, processed = Counter(), [], 0
+        try:
+            ledger = VerificationLedger(store.verification_path)
+            ledger.load()
+            for code, status, detail in verify_codes(store, codes, ledger):
+                processed += 1
+                counts[status] += 1
+                if status in FAILURES:
+                    failures.append((code, status, detail))
+                
+                if processed >= self.IMPORT_BATCH_SIZE:
+                    self.verify_queue.put(("batch", (processed, failures)))
+                    failures, processed = [], 0
             
+            ledger.save()
+            self.verify_queue.put(("batch", (processed, failures)))
+            self.verify_queue.put(("done", (counts, None)))
         except Exception as e:
-            messagebox.showerror("エラー", f"Data Matrixコードの生成に失敗しました: {str(e)}")
+            self.verify_queue.put(("batch", (processed, failures)))
+            self.verify_queue.put(("done", (counts, e)))
     
-    def generate_datamatrix(self, data):
-        """Data Matrixコードを生成"""
-        if not DATAMATRIX_AVAILABLE:
-            raise ImportError("pylibdmtxがインストールされていません")
+    def poll_verification(self):
+        """Tkスレッド: 検証の進捗を表示する"""
+        try:
+            while True:
+                kind, value = self.verify_queue.get_nowait()
+                if kind == "done":
+                    self.finish_verification(*value)
+                    return
+                processed, failures = value
+                self.verify_done += processed
+                self.verify_failures.extend(failures)
+        except queue.Empty:
+            pass
         
-        encoded = pylibdmtx.encode(data.encode('utf8'))
-        return Image.frombytes('RGB', (encoded.width, encoded.height), encoded.pixels)
+        self.title_label.config(text=f"検証中... {self.verify_done}/{self.verify_total}")
+        self.root.after(self.IMPORT_POLL_MS, self.poll_verification)
+    
+    def finish_verification(self, counts, error):
+        """検証完了時に結果をまとめて表示する（問題のあったコードは先頭の数件を示す）"""
+        self.verify_thread = None
+        self.verify_button.config(state=tk.NORMAL)
+        self.title_label.config(text="Data Matrixコードツール")
+        
+        summary = "\n".join(f"{STATUS_LABELS[status]}: {count}件"
+                            for status, count in counts.items() if count)
+        if error is not None:
+            messagebox.showerror("エラー", f"検証中にエラーが発生しました: {str(error)}\n{summary}")
+            return
+        
+        if not self.verify_failures:
+            messagebox.showinfo("情報", f"{self.verify_done}個のコードを検証しました。\n{summary}")
+            return
+        
+        lines = []
+        for code, status, detail in self.verify_failures[:5]:
+            index = self.index_of(code)
+            position = f"コード {index + 1}" if index is not None else "削除済み"
+            line = f"{position}: {code.data} - {STATUS_LABELS[status]}"
+            if status == MISMATCH:
+                line += f"（読み取り: {detail}）"
+            lines.append(line)
+        logger.warning("検証で%d個のコードに問題がありました", len(self.verify_failures))
+        for code, status, detail in self.verify_failures:
+            logger.warning("  %s: %s %s", code.data, STATUS_LABELS[status], detail or "")
+        messagebox.showwarning("警告", f"{len(self.verify_failures)}個のコードに問題があります。\n"
+                             f"{summary}\n\n" + "\n".join(lines))
+    
+    def start_export(self):
+        """
+        コードをdataのキャプション付きで並べた印刷用シート（PDF、またはページごとのPNG）を書き出す
+        絞り込み中は一致したコードだけにするかを選べる
+        ページの合成はワーカースレッドからプロセスプールで並列に行い、進捗はキュー経由でTkスレッドに反映する
+        """
+        if self.export_thread is not None:
+            messagebox.showinfo("情報", "印刷用シートを書き出し中です")
+            return
+        
+        if not self.datamatrix_codes:
+            messagebox.showinfo("情報", "印刷するコードがありません")
+            return
+        
+        # 保存先の選択中や書き出し中にコードを追加・削除してもページの内容がずれないよう、印刷するのは今の一覧の複製
+        codes = list(self.datamatrix_codes)
+        if self.filtered_codes is not None and len(self.filtered_codes) < len(codes):
+            answer = messagebox.askyesnocancel(
+                "印刷", f"絞り込み中の{len(self.filtered_codes)}個のコードだけを印刷しますか？\n"
+                f"（いいえを選ぶと全{len(codes)}個のコードを印刷します）")
+            if answer is None:
+                return
+            if answer:
+                codes = list(self.filtered_codes)
+        if not codes:
+            messagebox.showinfo("情報", "印刷するコードがありません")
+            return
+        
+        path = filedialog.asksaveasfilename(
+            title="印刷用シートの保存先",
+            defaultextension=".pdf",
+            filetypes=[("PDF", "*.pdf"), ("PNG（ページごと）", "*.png")]
+        )
+        if not path:
+            return
+        
+        self.export_pages = 0
+        self.export_button.config(state=tk.DISABLED)
+        
+        self.export_thread = threading.Thread(target=self.export_worker,
+                                              args=(self.store, codes, path), daemon=True)
+        self.export_thread.start()
+        self.root.after(self.IMPORT_POLL_MS, self.poll_export)
+    
+    def export_worker(self, store, codes, path):
+        """ワーカースレッド: シートを書き出し、ページを書き出すごとに進捗をキューへ送る"""
+        from datamatrix_export import SheetLayout, code_sheet_items, write_sheets
+        
+        layout = SheetLayout()
+        total = -(-len(codes) // layout.per_page)
+        errors = []
+        try:
+            fmt = "png" if path.lower().endswith(".png") else "pdf"
+            pages = write_sheets(code_sheet_items(store, codes, errors), path, fmt, layout,
+                                 on_page=lambda count: self.export_queue.put(("page", (count, total))))
+            self.export_queue.put(("done", (path, pages, errors, None)))
+        except Exception as e:
+            self.export_queue.put(("done", (path, 0, errors, e)))
+    
+    def poll_export(self):
+        """Tkスレッド: 書き出したページ数を表示する"""
+        total = None
+        try:
+            while True:
+                kind, value = self.export_queue.get_nowait()
+                if kind == "done":
+                    self.finish_export(*value)
+                    return
+                self.export_pages, total = value
+        except queue.Empty:
+            pass
+        
+        if total is not None:
+            self.title_label.config(text=f"印刷用シートを作成中... {self.export_pages}/{total}ページ")
+        self.root.after(self.IMPORT_POLL_MS, self.poll_export)
+    
+    def finish_export(self, path, pages, errors, error):
+        """書き出し完了時に結果を表示する（画像を読み込めなかったコードは先頭の数件を示す）"""
+        self.export_thread = None
+        self.export_button.config(state=tk.NORMAL)
+        self.title_label.config(text="Data Matrixコードツール")
+        
+        if error is not None:
+            messagebox.showerror("エラー", f"印刷用シートの書き出し中にエラーが発生しました: {str(error)}")
+            return
+        
+        if errors:
+            details = "\n".join(f"{code.data}: {message}" for code, message in errors[:5])
+            messagebox.showwarning("警告", f"{pages}ページの印刷用シートを書き出しました: {path}\n"
+                                 f"{len(errors)}個のコードは画像を読み込めませんでした:\n{details}")
+        else:
+            messagebox.showinfo("情報", f"{pages}ページの印刷用シートを書き出しました: {path}")
+    
+    def generate_datamatrix(self, data, **options):
+        """Data Matrixコードを生成"""
+        return generate_datamatrix(data, **options)
     
     def prev_code(self):
-        """前のコードを表示"""
-        if self.datamatrix_codes:
+        """前のコードを表示（絞り込み中は一致したコードの中で移動）"""
+        if self.filtered_codes is not None:
+            self.step_filtered(-1)
+        elif self.datamatrix_codes:
             self.current_index = (self.current_index - 1) % len(self.datamatrix_codes)
             self.update_display()
             
     def next_code(self):
-        """次のコードを表示"""
-        if self.datamatrix_codes:
+        """次のコードを表示（絞り込み中は一致したコードの中で移動）"""
+        if self.filtered_codes is not None:
+            self.step_filtered(1)
+        elif self.datamatrix_codes:
             self.current_index = (self.current_index + 1) % len(self.datamatrix_codes)
             self.update_display()
     
+    def step_filtered(self, step):
+        """絞り込み結果の中で前後のコードを選択（現在のコードが結果になければ先頭か末尾から）"""
+        if not self.filtered_codes:
+            return
+        if self.filter_position is None:
+            position = 0 if step > 0 else len(self.filtered_codes) - 1
+        else:
+            position = (self.filter_position + step) % len(self.filtered_codes)
+        self.select_code(position)
+    
     def update_display(self):
         """コードの表示を更新"""
         # デバッグ情報表示
-        print(f"update_display が呼ばれました。コード数: {len(self.datamatrix_codes)}")
+        logger.debug("update_display が呼ばれました。コード数: %d", len(self.datamatrix_codes))
         
         if not self.datamatrix_codes:
             # コードがない場合はプレースホルダーを表示
-            self.code_display.config(text="Data Matrixコードがありません\n追加ボタンでコードを登録してください", 
-                                   image="", compound=tk.CENTER)
+            text = "Data Matrixコードがありません\n追加ボタンでコードを登録してください"
+            if self.presets_pending:
+                text = "プリセットを作成中..."
+            self.code_display.config(text=text, image="", compound=tk.CENTER)
             # ボタンも明示的に更新
             self.update_buttons()
             return
@@ -359,14 +1177,16 @@ class DataMatrixTool:
         code_data = self.datamatrix_codes[self.current_index]
         
         # 現在表示中のコードの情報を表示（インデックス番号とデータ）
-        code_info = f"コード {self.current_index + 1}/{len(self.datamatrix_codes)}: {code_data['data']}"
-        
-        # Base64からイメージを復元
-        img_data = base64.b64decode(code_data["image"])
-        img = Image.open(BytesIO(img_data))
+        code_info = f"コード {self.current_index + 1}/{len(self.datamatrix_codes)}: {code_data.data}"
+        if code_data.symbology != DEFAULT_SYMBOLOGY:
+            code_info += f" [{SYMBOLOGIES.get(code_data.symbology, code_data.symbology)}]"
+        if self.filtered_codes is not None:
+            code_info += f"\n絞り込み: {len(self.filtered_codes)}件"
         
-        # 画像はリサイズせず、オリジナルサイズで表示
-        self.photo = ImageTk.PhotoImage(img)
+        # キャッシュから拡大済みの表示用画像を取得（なければ画像ストアから読み込んで拡大する）
+        scale = self.display_scale(code_data)
+        self.photo = self.photo_cache.get(self.photo_key(code_data, scale),
+                                          lambda: self.create_photo(code_data, scale))
         
         # ラベルを更新し、コード情報も表示
         self.code_display.config(image=self.photo, text=code_info, compound=tk.BOTTOM)
@@ -374,127 +1194,661 @@ class DataMatrixTool:
         
         # ボタンも明示的に更新
         self.update_buttons()
+        
+        # 前後のコードをアイドル時に先読み
+        self.schedule_prefetch()
+    
+    def photo_key(self, code, scale):
+        """
+        表示用画像キャッシュのキー（コードの識別子、画像内容のハッシュ、拡大率）
+        ペイロードのみのコードは (data, オプション) が内容を決める
+        """
+        return (id(code), self.store.content_key(code), scale)
+    
+    def zoom_label(self, level):
+        """拡大率の表示名"""
+        return "自動" if level == 0 else f"×{level}"
+    
+    def on_zoom_selected(self, label):
+        """拡大率のメニューで選択された拡大率に切り替える"""
+        for level in self.ZOOM_LEVELS:
+            if self.zoom_label(level) == label:
+                self.set_zoom(level)
+    
+    def step_zoom(self, step):
+        """拡大率を1段階ずつ変更する（自動の次は×1）"""
+        position = self.ZOOM_LEVELS.index(self.zoom) + step
+        self.set_zoom(self.ZOOM_LEVELS[min(max(position, 0), len(self.ZOOM_LEVELS) - 1)])
+    
+    def set_zoom(self, level):
+        """拡大率を変更する（連続した変更は最後の1回だけ描き直す）"""
+        self.zoom = level
+        self.zoom_var.set(self.zoom_label(level))
+        self.schedule_rescale()
+    
+    def schedule_rescale(self):
+        """リサイズや拡大率の変更が止まってから表示を描き直す"""
+        if self._rescale_job is not None:
+            self.root.after_cancel(self._rescale_job)
+        self._rescale_job = self.root.after(self.RESCALE_DELAY_MS, self.apply_rescale)
+    
+    def apply_rescale(self):
+        """
+        表示エリアの大きさを取り直して現在のコードを描き直す
+        大きさが変わったときだけ拡大済みの画像を破棄する（拡大率の変更では破棄しない）
+        """
+        self._rescale_job = None
+        size = (self.display_frame.winfo_width(), self.display_frame.winfo_height())
+        if size[0] <= 1 or size[1] <= 1:
+            # 非表示中（UI切替やフォーム表示中）は大きさが取れないので前の値を使う
+            return
+        if size != self.display_size:
+            self.display_size = size
+            self.photo_cache.clear()
+        self.update_display()
+    
+    def symbol_size(self, code):
+        """シンボル画像の元の大きさ（PNGのヘッダーから読み、内容ごとに記録しておく）"""
+        key = self.store.content_key(code)
+        size = self.symbol_sizes.get(key)
+        if size is None:
+            from PIL import Image
+            size = self.symbol_sizes[key] = Image.open(BytesIO(self.store.load_png(code))).size
+        return size
+    
+    def display_scale(self, code):
+        """codeを表示する整数の拡大率（自動なら表示エリアに収まる最大の倍率、最小は1）"""
+        if self.zoom:
+            return self.zoom
+        width, height = self.symbol_size(code)
+        # 枠線と余白の分を除いた大きさに収める
+        available_width = self.display_size[0] - 14
+        available_height = self.display_size[1] - 14 - self.CAPTION_HEIGHT
+        return max(1, min(available_width // width, available_height // height))
+    
+    def scaled_image(self, code, scale):
+        """画像ストアのPNG（ペイロードのみなら再生成したシンボル）を最近傍法で整数倍に拡大する"""
+        from PIL import Image
+        
+        png = self.store.load_png(code)
+        with span("decode"):
+            img = Image.open(BytesIO(png))
+            img.load()
+        
+        # 整数倍の最近傍法なのでモジュールの境界がぼやけず、スキャナーで読み取れる
+        if scale > 1:
+            with span("scale"):
+                img = img.resize((img.width * scale, img.height * scale), Image.NEAREST)
+        return img
+    
+    def create_photo(self, code, scale):
+        """拡大したシンボルから表示用のPhotoImageを作成"""
+        from PIL import ImageTk
+        
+        img = self.scaled_image(code, scale)
+        with span("photoimage"):
+            return ImageTk.PhotoImage(img)
+    
+    def schedule_prefetch(self):
+        """現在のコードの前後の画像をアイドル時に先読みする"""
+        if self._prefetch_job is not None:
+            self.root.after_cancel(self._prefetch_job)
+        self._prefetch_job = self.root.after_idle(self.prefetch_neighbours)
+    
+    def prefetch_neighbours(self):
+        """current_indexの前後のコードをキャッシュに読み込む"""
+        self._prefetch_job = None
+        count = len(self.datamatrix_codes)
+        if count <= 1:
+            return
+        
+        for offset in range(1, self.PREFETCH_RADIUS + 1):
+            for index in (self.current_index + offset, self.current_index - offset):
+                code = self.datamatrix_codes[index % count]
+                try:
+                    scale = self.display_scale(code)
+                    self.photo_cache.prefetch(self.photo_key(code, scale),
+                                              lambda code=code, scale=scale: self.create_photo(code, scale))
+                except Exception as e:
+                    logger.warning("画像の先読みに失敗しました: %s", e)
+    
+    def write_record(self, record):
+        """
+        ジャーナルへの追記をワーカースレッドで行う（ネットワーク上のホームなどでTkのイベントループを止めない）
+        保存と同じスレッドなので、追記と保存は変更した順に行われる
+        """
+        future = self.save_executor.submit(self.store.write_record, record)
+        future.add_done_callback(self.on_record_written)
+    
+    def on_record_written(self, future):
+        """ワーカースレッド: 追記の失敗を出力する"""
+        try:
+            future.result()
+        except Exception as e:
+            # 一覧には反映済みなので、次の保存でインデックスに書き込まれる
+            logger.error("変更の記録に失敗しました: %s", e)
+    
+    def sync_store(self):
+        """
+        他のインスタンスがジャーナルに追記した変更とコードセットを定期的に取り込む
+        ファイルの読み込みはワーカースレッド（保存と同じスレッド）で行い、
+        読み終えたかをTkスレッドで確かめてから一覧に反映する（ワーカースレッドからTkを呼ばない）
+        """
+        self._sync_job = None
+        if self._sync_read is None:
+            store, code_sets = self.store, self.code_sets
+            future = self.save_executor.submit(lambda: (store.read_changes(), code_sets.read_new_sets()))
+            self._sync_read = (store, future)
+            delay = self.IMPORT_POLL_MS
+        elif self._sync_read[1].done():
+            store, future = self._sync_read
+            self._sync_read = None
+            self.apply_store_changes(store, future)
+            delay = self.SYNC_INTERVAL_MS
+        else:
+            delay = self.IMPORT_POLL_MS
+        self._sync_job = self.root.after(delay, self.sync_store)
+    
+    def apply_store_changes(self, store, future):
+        """
+        Tkスレッド: ワーカースレッドで読んだ変更を、読み込み元のstoreとコードセットの一覧に反映する
+        表示中のコードが残っていれば、位置が変わってもそのコードを表示し続ける
+        """
+        try:
+            changes, new_sets = future.result()
+        except Exception as e:
+            logger.warning("他のインスタンスの変更を取り込めませんでした: %s", e)
+            return
+        
+        current = self.datamatrix_codes[self.current_index] if self.datamatrix_codes else None
+        added, removed, reloaded = store.apply_changes(changes)
+        # 読み込み中にセットを切り替えていれば、読み込み元のセットに反映するだけにする
+        if store is self.store and (added or removed or reloaded):
+            self.on_store_changed(current, added, removed, reloaded)
+        if self.code_sets.add_sets(new_sets):
+            self.refresh_set_menu()
+    
+    def on_store_changed(self, current, added, removed, reloaded):
+        """他のインスタンスでの追加・削除を検索インデックスと表示に反映する"""
+        logger.info("他のインスタンスの変更を取り込みました（追加 %d件、削除 %d件）", len(added), len(removed))
+        for code in removed:
+            self.photo_cache.discard_code(id(code))
+        if reloaded:
+            self.search_index = None
+        elif self.search_index is not None:
+            for code in removed:
+                self.search_index.remove(code)
+            for code in added:
+                self.search_index.add(code)
+        
+        index = self.index_of(current) if current is not None else None
+        if index is not None:
+            self.current_index = index
+        else:
+            self.current_index = min(self.current_index, max(len(self.datamatrix_codes) - 1, 0))
+        
+        if self.search_query:
+            self.refresh_filter()
+        self.update_display()
     
     def get_config_path(self):
-        """ユーザーごとの設定ファイルパスを取得"""
-        # Windowsのログインユーザー名を取得
-        username = getpass.getuser()
-        
-        # ユーザーのホームディレクトリを取得
-        home_dir = os.path.expanduser('~')
-        # アプリケーションの設定ディレクトリを作成
-        config_dir = os.path.join(home_dir, '.datamatrix_tool')
-        
-        # ディレクトリが存在しない場合は作成
-        if not os.path.exists(config_dir):
-            try:
-                os.makedirs(config_dir)
-            except Exception as e:
-                print(f"設定ディレクトリの作成に失敗しました: {str(e)}")
-                # 失敗した場合はカレントディレクトリを使用
-                return f"datamatrix_codes_{username}.json"
-        
-        # ユーザー固有の設定ファイルパス
-        return os.path.join(config_dir, f'datamatrix_codes_{username}.json')
+        """ユーザーごとの設定ファイルパスを取得（旧形式の単一JSON）"""
+        return get_config_path()
     
     def save_codes(self):
-        """コードをJSONファイルに保存"""
-        data = {
-            "codes": self.datamatrix_codes,
-            "current_index": self.current_index
-        }
-        
+        """コードのインデックスをJSONファイルに今すぐ保存（画像は追加時に画像ストアへ保存済み）"""
         try:
-            config_path = self.get_config_path()
-            with open(config_path, "w") as f:
-                json.dump(data, f)
-            print(f"コードを保存しました: {config_path}")
+            self.store.save()
+            logger.info("コードを保存しました: %s", self.store.index_path)
         except Exception as e:
-            print(f"コードの保存に失敗しました: {str(e)}")
+            logger.error("コードの保存に失敗しました: %s", e)
+    
+    def request_save(self):
+        """
+        保存を予約する
+        SAVE_DELAY_MSの間に続いた追加・削除はまとめて1回の書き込みになる
+        """
+        if self._save_job is not None:
+            self.root.after_cancel(self._save_job)
+        self._save_job = self.root.after(self.SAVE_DELAY_MS, self.flush_save)
+    
+    def flush_save(self):
+        """Tkスレッドで現在の状態を複製し、書き込みはワーカースレッドで行う"""
+        self._save_job = None
+        store = self.store
+        future = self.save_executor.submit(store.write_snapshot, store.snapshot())
+        future.add_done_callback(lambda f: self.on_saved(f, store.index_path))
+    
+    def on_saved(self, future, path):
+        """ワーカースレッド: 保存結果を出力する（pathは保存したセットのインデックス）"""
+        try:
+            if future.result() is False:
+                logger.info("他のインスタンスが先に保存したため、変更はジャーナルに残しました: %s", path)
+            else:
+                logger.info("コードを保存しました: %s", path)
+        except Exception as e:
+            logger.error("コードの保存に失敗しました: %s", e)
+    
+    def on_close(self):
+        """
+        ウィンドウを閉じるときに実行中の処理を待ってから最終状態を保存する
+        保存は他のインスタンスの変更を取り込んでから行うので、それらを上書きして失うことはない
+        """
+        if self._save_job is not None:
+            self.root.after_cancel(self._save_job)
+            self._save_job = None
+        if self._sync_job is not None:
+            self.root.after_cancel(self._sync_job)
+            self._sync_job = None
+        if self._encode_poll_job is not None:
+            self.root.after_cancel(self._encode_poll_job)
+            self._encode_poll_job = None
+        self.encode_executor.shutdown(wait=True)
+        # 閉じる直前に追加したコードなど、完了した符号化の結果を一覧に反映してから保存する
+        self.poll_encode()
+        self.save_executor.shutdown(wait=True)
+        self.save_codes()
+        self.root.destroy()
     
     def load_codes(self):
-        """JSONファイルからコードをロード"""
+        """最後に開いていたコードセットをロード（旧形式のJSONは一度だけ移行する）"""
+        try:
+            self.code_sets.load()
+        except Exception as e:
+            logger.error("コードセットの一覧のロードに失敗しました: %s", e)
+        self.refresh_set_menu()
+        
         try:
-            config_path = self.get_config_path()
-            if os.path.exists(config_path):
-                with open(config_path, "r") as f:
-                    data = json.load(f)
-                    self.datamatrix_codes = data.get("codes", [])
-                    self.current_index = data.get("current_index", 0)
-                    
-                    # インデックスが範囲外の場合は調整
-                    if self.datamatrix_codes and not (0 <= self.current_index < len(self.datamatrix_codes)):
-                        self.current_index = 0
-                print(f"コードをロードしました: {config_path}")
+            self.store = self.code_sets.open(self.code_sets.current)
+            logger.info("コードをロードしました: %s", self.store.index_path)
             
-            # ロードされたコードがなければ初期プリセットを作成
-            if not self.datamatrix_codes:
-                print("初期プリセットを作成します")
+            # 既定のセットにコードがなければ初期プリセットを作成（作成したセットは空のまま）
+            if not self.datamatrix_codes and self.code_sets.current == CodeSets.DEFAULT_SET:
+                logger.info("初期プリセットを作成します")
                 self.create_presets()
                 
         except Exception as e:
-            print(f"コードのロードに失敗しました: {str(e)}")
+            logger.error("コードのロードに失敗しました: %s", e)
             # エラーが発生した場合も初期プリセットを作成
-            print("エラーが発生したため、初期プリセットを作成します")
+            logger.info("エラーが発生したため、初期プリセットを作成します")
+            self.store = CodeStore(self.code_sets.config_path_for(self.code_sets.current))
             self.create_presets()
     
-    def create_presets(self):
-        """初期プリセットを作成"""
-        if not DATAMATRIX_AVAILABLE:
-            print("pylibdmtxがインストールされていないため、プリセットを作成できません")
+    def refresh_set_menu(self):
+        """コードセットの選択メニューを作り直す"""
+        menu = self.set_menu["menu"]
+        menu.delete(0, tk.END)
+        for name in self.code_sets.names:
+            menu.add_command(label=name, command=lambda name=name: self.switch_set(name))
+        menu.add_separator()
+        menu.add_command(label="新しいセット...", command=self.create_set)
+        self.set_var.set(self.code_sets.current)
+    
+    def create_set(self):
+        """名前を入力して空のコードセットを作成し、そのセットに切り替える"""
+        name = simpledialog.askstring("新しいセット", "セット名:", parent=self.root)
+        if name is None:
             return
-            
+        if not self.can_switch_set():
+            return
+        self.start_set_task(partial(self.code_sets.reserve, name), self.on_set_created)
+    
+    def on_set_created(self, future):
+        """Tkスレッド: 一覧のファイルに登録したセットを一覧に加えて切り替える"""
+        try:
+            name, sets = future.result()
+        except ValueError as e:
+            messagebox.showerror("エラー", str(e))
+            return
+        except Exception as e:
+            logger.error("コードセットの作成に失敗しました: %s", e)
+            messagebox.showerror("エラー", f"セットの作成に失敗しました: {str(e)}")
+            return
+        self.code_sets.add_created(name, sets)
+        self.switch_set(name)
+    
+    def can_switch_set(self):
+        """
+        インポート、検証、コードの生成（追加やプリセット）の間は結果の対象が変わらないようセットを切り替えない
+        生成したコードは開始時のセットの画像ストアに保存されるので、そのセットの一覧に追加する必要がある
+        """
+        running = [task for task, busy in (("インポート", self.import_thread is not None),
+                                           ("検証", self.verify_thread is not None),
+                                           ("コードの生成", self.encode_pending > 0),
+                                           ("セットの切り替え", self._set_task is not None))
+                   if busy]
+        if running:
+            messagebox.showinfo("情報", f"{running[0]}中はセットを切り替えられません")
+            self.set_var.set(self.code_sets.current)
+            return False
+        return True
+    
+    def start_set_task(self, func, callback, *args):
+        """
+        コードセットのファイル操作funcをワーカースレッド（保存と同じスレッド）で行い、
+        完了したらTkスレッドでcallback(*args, future)を呼ぶ（ネットワーク上の共有でTkのイベントループを止めない）
+        """
+        self._set_task = (self.save_executor.submit(func), callback, args)
+        self.root.after(self.ENCODE_POLL_MS, self.poll_set_task)
+    
+    def poll_set_task(self):
+        """Tkスレッド: コードセットのファイル操作が終わっていれば結果を反映する"""
+        future, callback, args = self._set_task
+        if not future.done():
+            self.root.after(self.ENCODE_POLL_MS, self.poll_set_task)
+            return
+        self._set_task = None
+        callback(*args, future)
+    
+    def switch_set(self, name):
+        """
+        コードセットを切り替える
+        セットのロード（メモリに残っていれば、離れている間の他のインスタンスの変更の読み込み）は
+        ワーカースレッドで行い、終わったらfinish_switch_setで表示を切り替える
+        """
+        if name == self.code_sets.current or not self.can_switch_set():
+            self.set_var.set(self.code_sets.current)
+            return
+        
+        store = self.code_sets.cached(name)
+        code_sets = self.code_sets
+        
+        def load():
+            loaded = store if store is not None else code_sets.load_store(name)
+            return loaded, loaded.read_changes()
+        
+        self.title_label.config(text=f"「{name}」を読み込み中...")
+        self.start_set_task(load, self.finish_switch_set, name)
+    
+    def finish_switch_set(self, name, future):
+        """Tkスレッド: ロードしたセットに切り替え、メモリに残っているセットはファイルを読み直さずに表示する"""
+        self.title_label.config(text="Data Matrixコードツール")
+        try:
+            store, changes = future.result()
+        except Exception as e:
+            logger.error("コードセットのロードに失敗しました: %s", e)
+            messagebox.showerror("エラー", f"セット「{name}」のロードに失敗しました: {str(e)}")
+            self.set_var.set(self.code_sets.current)
+            return
+        
+        # LRUから外れても変更が失われないよう、保存待ちの変更を先に書き込む
+        if self._save_job is not None:
+            self.root.after_cancel(self._save_job)
+            self.flush_save()
+        
+        # メモリに残っていたセットは、離れている間の他のインスタンスの変更を取り込む
+        try:
+            store.apply_changes(changes)
+        except Exception as e:
+            logger.warning("他のインスタンスの変更を取り込めませんでした: %s", e)
+        self.code_sets.remember(name, store)
+        
+        self.store = store
+        self.code_sets.current = name
+        self.save_executor.submit(self.code_sets.write_snapshot, self.code_sets.snapshot())
+        
+        # 検索と選択ボタンの状態はセットごとに作り直す
+        self.search_index = None
+        self.search_query = ""
+        self.filtered_codes = None
+        self.filter_position = None
+        self.button_offset = 0
+        self.search_var.set("")
+        self.refresh_set_menu()
+        self.update_display()
+    
+    def create_presets(self):
+        """初期プリセットをワーカースレッドで作成（起動時の表示を待たせない）"""
         presets = [
             {"name": "TestString", "data": "ts"},
             {"name": "Number", "data": "12"},
             {"name": "テスト", "data": "test"}
         ]
         
+        store = self.store
+        
+        def build_presets():
+            if not datamatrix_available():
+                logger.warning("Data Matrixエンコーダーがないため、プリセットを作成できません")
+                return []
+            return [store.build_code(preset["data"], name=preset["name"]) for preset in presets]
+        
+        self.presets_pending = True
+        self.submit_encode(self.on_presets_built, build_presets)
+    
+    def on_presets_built(self, future):
+        """Tkスレッド: 作成したプリセットを一覧に追加して表示する"""
         try:
-            for preset in presets:
-                # Data Matrixコードを生成
-                img = self.generate_datamatrix(preset["data"])
-                
-                # 画像をBase64に変換
-                buffered = BytesIO()
-                img.save(buffered, format="PNG")
-                img_str = base64.b64encode(buffered.getvalue()).decode()
-                
-                # コードを保存
-                self.datamatrix_codes.append({
-                    "name": preset["name"],
-                    "data": preset["data"],
-                    "image": img_str
-                })
+            codes = future.result()
+        except Exception as e:
+            logger.error("プリセット作成中にエラーが発生しました: %s", e)
+            codes = []
+        
+        self.presets_pending = False
+        if codes:
+            self.add_codes(codes)
             
             # 最初のプリセットを選択
             self.current_index = 0
-            print(f"{len(presets)}個のプリセットを作成しました")
+            self.locate_current()
+            logger.info("%d個のプリセットを作成しました", len(codes))
             
             # 設定ファイルに保存
-            self.save_codes()
-            
-        except Exception as e:
-            print(f"プリセット作成中にエラーが発生しました: {str(e)}")
+            self.request_save()
+        
+        self.update_display()
+        if codes and "first_code" not in self.startup_metrics:
+            self.record_startup_metric("first_code")
 
 
+def missing_encoder_message(symbology):
+    """シンボル体系のエンコーダーがないときに表示するメッセージ"""
+    if symbology == "qr":
+        return "QRコードのエンコーダーがありません。\n'pip install qrcode'を実行してください。"
+    return ("Data Matrixエンコーダーがありません。\n"
+            "'pip install pylibdmtx'（またはnumpy）を実行してください。")
 
-if __name__ == "__main__":
-    # pylibdmtxが利用可能か確認
-    if not DATAMATRIX_AVAILABLE:
-        print("警告: pylibdmtxがインストールされていません。")
-        print("Data Matrixコードを生成するには次のコマンドを実行してください:")
-        print("pip install pylibdmtx")
-        # それでも続行する
+
+def run_render(args):
+    """renderコマンド: tkinterを使わずにペイロードを符号化して書き出す"""
+    from datamatrix_export import OUTPUT_FORMATS, render_batch
+    
+    if not symbology_available(args.symbology):
+        print(missing_encoder_message(args.symbology).replace("\n", ""), file=sys.stderr)
+        return 1
+    
+    output = args.output or ("sheet" + OUTPUT_FORMATS["sheet"] if args.format == "sheet" else "out")
+    
+    def payloads():
+        """入力ファイル（省略時や-は標準入力）からペイロードを順に読み込む"""
+        for path in args.inputs or ["-"]:
+            if path == "-":
+                for data, _ in iter_payloads(sys.stdin, args.input_format or "lines"):
+                    yield data
+                continue
+            with open(path, "r", newline="", encoding="utf-8-sig") as f:
+                for data, _ in iter_payloads(f, args.input_format or detect_import_format(path)):
+                    yield data
+    
+    stats = {"startup_seconds": time.perf_counter() - _START_TIME, "first_result_seconds": None}
+    started = time.perf_counter()
+    
+    def on_result(data, error):
+        if stats["first_result_seconds"] is None:
+            stats["first_result_seconds"] = time.perf_counter() - _START_TIME
+        if error is not None:
+            print(f"生成に失敗しました: {data}: {error}", file=sys.stderr)
+    
+    written, errors = render_batch(payloads(), args.format, output, jobs=args.jobs,
+                                   on_result=on_result, symbology=args.symbology)
+    
+    elapsed = time.perf_counter() - started
+    if args.stats:
+        stats.update({
+            "format": args.format,
+            "symbology": args.symbology,
+            "encoder": encoder_name() if args.symbology == DEFAULT_SYMBOLOGY else "qrcode",
+            "jobs": args.jobs,
+            "written": written,
+            "failed": len(errors),
+            "render_seconds": elapsed,
+            "codes_per_second": (written + len(errors)) / elapsed if elapsed > 0 else None,
+        })
+        print(json.dumps(stats), file=sys.stderr)
+    return 1 if errors else 0
+
+
+def run_verify(args):
+    """verifyコマンド: コードセットの保存済み画像を読み取り、dataと一致するかを検証する"""
+    if not decoder_available():
+        print("検証にはpylibdmtxが必要です。'pip install pylibdmtx'を実行してください。", file=sys.stderr)
+        return 1
+    
+    code_sets = CodeSets(get_config_path())
+    code_sets.load()
+    name = args.set or code_sets.current
+    if name not in code_sets.sets:
+        print(f"コードセット「{name}」はありません（{', '.join(code_sets.names)}）", file=sys.stderr)
+        return 1
+    store = code_sets.open(name)
+    
+    ledger = VerificationLedger(store.verification_path)
+    ledger.load()
+    counts, failures = Counter(), 0
+    for code, status, detail in verify_codes(store, store.codes, ledger, jobs=args.jobs):
+        counts[status] += 1
+        if status in FAILURES:
+            failures += 1
+            print(f"{STATUS_LABELS[status]}: {code.data}" + (f" ({detail})" if detail else ""))
+    ledger.save()
+    
+    summary = ", ".join(f"{STATUS_LABELS[status]} {count}件" for status, count in counts.items())
+    print(f"{name}: {len(store.codes)}件を検証しました（{summary}）", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def run_export(args):
+    """exportコマンド: コードセットのコード（検索語で絞り込み可）をdataのキャプション付きの印刷用シートに書き出す"""
+    from datamatrix_export import SheetLayout, code_sheet_items, write_sheets
+    
+    code_sets = CodeSets(get_config_path())
+    code_sets.load()
+    name = args.set or code_sets.current
+    if name not in code_sets.sets:
+        print(f"コードセット「{name}」はありません（{', '.join(code_sets.names)}）", file=sys.stderr)
+        return 1
+    store = code_sets.open(name)
+    
+    codes = CodeIndex(store.codes).search(args.search) if args.search else store.codes
+    if not codes:
+        print(f"{name}: 印刷するコードがありません", file=sys.stderr)
+        return 1
+    
+    output = args.output or "sheet.pdf"
+    fmt = "png" if output.lower().endswith(".png") else "pdf"
+    layout = SheetLayout(dpi=args.dpi, columns=args.columns, rows=args.rows)
+    errors = []
+    started = time.perf_counter()
+    pages = write_sheets(code_sheet_items(store, codes, errors), output, fmt, layout, jobs=args.jobs)
+    for code, message in errors:
+        print(f"画像を読み込めませんでした: {code.data}: {message}", file=sys.stderr)
+    print(f"{name}: {len(codes) - len(errors)}件を{pages}ページに書き出しました"
+          f"（{time.perf_counter() - started:.1f}秒）: {output}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def run_gui(args):
+    """GUIを起動する"""
+    if not GUI_AVAILABLE:
+        print("tkinterが利用できないため、GUIを起動できません。", file=sys.stderr)
+        return 1
+    
+    # 起動時の一括インポート用データを読み込む
+    import_payloads = None
+    if args.import_path == "-":
+        import_payloads = read_payloads(sys.stdin, args.import_format or "lines")
+    elif args.import_path:
+        with open(args.import_path, "r", newline="", encoding="utf-8-sig") as f:
+            import_payloads = read_payloads(f, args.import_format or detect_import_format(args.import_path))
     
     root = tk.Tk()
     root.geometry("350x250")  # 少し幅を広げてボタン用のスペースを確保
     app = DataMatrixTool(root)
     
-    # ウィンドウが表示された後に表示を更新（ボタンも一緒に更新される）
-    root.after(100, app.update_display)
+    # 一括インポートはコードのロード後にバックグラウンドで開始
+    if import_payloads is not None:
+        app.after_startup(lambda: app.bulk_import(import_payloads))
+    
+    # 起動時間を計測する場合は、最初のコードを表示したら結果を出力して終了
+    if args.measure_startup:
+        def report_startup():
+            print(json.dumps(app.startup_metrics))
+            app.on_close()
+        app.after_startup(lambda: root.after(500, report_startup))
     
     # ウィンドウが閉じられるときにコードを保存
-    root.protocol("WM_DELETE_WINDOW", lambda: (app.save_codes(), root.destroy()))
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
+    
+    root.mainloop()
+    return 0
+
+
+def build_parser():
+    """コマンドライン引数のパーサーを作成"""
+    parser = argparse.ArgumentParser(description="Data Matrixコードツール")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="ログの出力レベル（省略時はDATAMATRIX_LOG_LEVELまたはINFO）")
+    parser.add_argument("--timing", action="store_true", default=None,
+                        help="処理時間を計測し、終了時（GUIではF12でも）に集計を出力")
+    parser.add_argument("--import", dest="import_path", metavar="FILE",
+                        help="起動時に一括インポートするファイル（-で標準入力）")
+    parser.add_argument("--import-format", choices=["csv", "tsv", "lines"],
+                        help="インポートファイルの形式（省略時は拡張子から判定）")
+    parser.add_argument("--measure-startup", action="store_true",
+                        help="起動時間（初回描画、最初のコード表示）をJSONで出力して終了")
     
-    root.mainloop()
\ No newline at end of file
+    subparsers = parser.add_subparsers(dest="command")
+    render = subparsers.add_parser("render", help="GUIなしでコードを一括生成して書き出す")
+    render.add_argument("inputs", nargs="*", metavar="INPUT",
+                        help="ペイロードの入力ファイル（省略時や-は標準入力）")
+    render.add_argument("--input-format", choices=["csv", "tsv", "lines"],
+                        help="入力ファイルの形式（省略時は拡張子から判定）")
+    render.add_argument("--symbology", choices=list(SYMBOLOGIES), default=DEFAULT_SYMBOLOGY,
+                        help="シンボル体系（datamatrix / qr）")
+    render.add_argument("-f", "--format", choices=["png", "svg", "sheet"], default="png",
+                        help="出力形式（sheetはdataをキャプションにした複数ページのPDF）")
+    render.add_argument("-o", "--output",
+                        help="出力先（png/svgはディレクトリ、sheetはファイル）")
+    render.add_argument("-j", "--jobs", type=int, default=None,
+                        help="符号化に使うプロセス数（省略時はCPU数、1でプロセスプールなし）")
+    render.add_argument("--stats", action="store_true",
+                        help="起動時間とスループットをJSONで標準エラーに出力")
+    
+    verify = subparsers.add_parser("verify", help="保存済みの画像を読み取り、dataと一致するかを検証する")
+    verify.add_argument("--set", help="検証するコードセット（省略時は最後に開いていたセット）")
+    verify.add_argument("-j", "--jobs", type=int, default=None,
+                        help="読み取りに使うプロセス数（省略時はCPU数、1でプロセスプールなし）")
+    
+    export = subparsers.add_parser("export", help="保存済みのコードをキャプション付きの印刷用シートに書き出す")
+    export.add_argument("--set", help="書き出すコードセット（省略時は最後に開いていたセット）")
+    export.add_argument("--search", help="この検索語に一致するコードだけを書き出す")
+    export.add_argument("-o", "--output",
+                        help="出力先（省略時はsheet.pdf。.pngならページごとに-0001.png, -0002.png, ...）")
+    export.add_argument("--dpi", type=int, default=150, help="シートの解像度")
+    export.add_argument("--columns", type=int, default=4, help="1ページの列数")
+    export.add_argument("--rows", type=int, default=6, help="1ページの行数")
+    export.add_argument("-j", "--jobs", type=int, default=None,
+                        help="ページの合成に使うプロセス数（省略時はCPU数、1でプロセスプールなし）")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    configure_instrumentation(args.log_level, args.timing)
+    if args.command == "render":
+        sys.exit(run_render(args))
+    if args.command == "verify":
+        sys.exit(run_verify(args))
+    if args.command == "export":
+        sys.exit(run_export(args))
+    sys.exit(run_gui(args))